@@ -6,10 +6,26 @@ from config_utils import get_section_dict, get_config_value
 import re
 import json
 from log_utils import log_api_event
+from label_utils import build_label_matchers
+from profile_utils import profile_hook
 import logging
 import time
 
 class ApiPromptAsyncProcessor:
+    # 返回内容很短、可将多道题打包到一个请求中的任务
+    packable_tasks = ["reasoning_type", "problem_category", "knowledge_tag"]
+
+    # 标签任务的说明文字：单题 prompt（build_*_prompt）与打包 prompt（build_packed_prompt）共用，二者只在题目组织和输出格式上不同
+    reasoning_type_instruction = """你是一位精通数学文字题的专家，请根据题目的解答推理复杂程度对数学文字题进行分类。分类标准如下：
+        type_1(简单计算)：没有隐含关系，只需简单加减乘除计算即可解题。
+        type_2(单步公式)：可以直接使用数学公式，或者只需进行一步简单转换即可解决。
+        type_3(多步公式)：需要使用数学公式，并且必须经过多步转换才能解决。"""
+    reasoning_type_options = "分类选项: [type_1, type_2, type_3]"
+    problem_category_instruction = """你是一位资深小学数学专家，擅长对题目进行结构化分类。请根据题干列出该题目所属的类型（可多选）。
+        请尽量从以下问题分类中选择最接近的一个或多个"""
+    knowledge_tag_instruction = """你是一位小学数学教师，擅长分析题目所涉及的数学知识点。请根据题干列出其中涵盖的数学知识点（可多选）。
+        请尽量从以下知识点标签中选择最接近的一个或多个"""
+
     # 通过统一接口读取配置文件
     def __init__(self, config: configparser.ConfigParser):
         self.call_count = 0 # 新增：初始化请求计数器
@@ -27,17 +43,26 @@ class ApiPromptAsyncProcessor:
         self.problem_categories = prompt_cfg['problem_categories']
         self.knowledge_tags = prompt_cfg['knowledge_tags']
 
+        # 读取Label_Matching配置：将返回结果映射为标准标签，仅对无法映射的行定向重新请求
+        self.label_matching = get_config_value(config, 'Label_Matching', 'enable', fallback=False)
+        self.max_reask = get_config_value(config, 'Label_Matching', 'max_reask', fallback=1)
+        self.label_matchers = build_label_matchers(config) if self.label_matching else {}
+
+        # 读取Packing配置：每个请求打包的题目数量 K（1 表示不打包），以及打包请求每道题预留的 max_tokens
+        self.pack_sizes = {task: get_config_value(config, 'Packing', task, fallback=1) for task in self.packable_tasks}
+        self.packed_tokens_per_item = get_config_value(config, 'Packing', 'tokens_per_item', fallback=40)
+
         # 创建信号量限制并发请求数量
         max_concurrent = get_config_value(config, 'Processing_Mode', 'max_concurrent_requests')
         self.semaphore = asyncio.Semaphore(max_concurrent)
 
-    async def api_call(self, prompt, session, fallback=None, ERROR_INFO="[错误]"):
+    async def api_call(self, prompt, session, fallback=None, ERROR_INFO="[错误]", max_tokens=None):
         self.call_count += 1  # 请求计数器加一
         request_id = self.call_count
         
         # 截取最后30个字符作为请求返回失败时的预览
         # 先清理换行符，再统一处理摘要
-        cleaned_preview = re.sub(r'[\r\n]+', ' ', prompt_preview).strip()
+        cleaned_preview = re.sub(r'[\r\n]+', ' ', prompt).strip()
         prompt_preview = cleaned_preview[-30:] if len(cleaned_preview) > 30 else cleaned_preview
 
         start_time = time.time()
@@ -46,21 +71,24 @@ class ApiPromptAsyncProcessor:
             "model": self.model,
             "messages": [{"role": "user", "content": prompt}],
             "temperature": self.temperature,
-            "max_tokens": self.max_tokens
+            "max_tokens": max_tokens or self.max_tokens
         }
         headers = {
             "Authorization": f"Bearer {self.authorization_key}",
             "Content-Type": "application/json"
         }
         async with self.semaphore:
+            # elapsed 从进入排队前计时；service 从取得信号量后计时，只含请求本身（RunPlanner 按它推算耗时）
+            service_start = time.time()
             try:
                 async with session.post(self.url_async, json=body, headers=headers) as resp:
                     res = await resp.json()
                     elapsed = round(time.time() - start_time, 3)
+                    service = round(time.time() - service_start, 3)
                     
                     if "choices" in res:
                         # 成功返回时不传prompt_preview，失败时prompt_preview用于追踪
-                        log_api_event(request_id, "success", elapsed, False)
+                        log_api_event(request_id, "success", elapsed, False, service_time=service)
                         return res["choices"][0]["message"]["content"].strip()
                     
                     # 结构错误但没有触发异常
@@ -68,10 +96,11 @@ class ApiPromptAsyncProcessor:
                     # res 是 dict，先将它转成 JSON 字符串
                     bad_res_str = json.dumps(res, ensure_ascii=False)
                     prompt_preview = bad_res_str[-30:] if len(bad_res_str) > 30 else bad_res_str
-                    log_api_event(request_id, "bad_response", elapsed, True, prompt_preview)
+                    log_api_event(request_id, "bad_response", elapsed, True, prompt_preview, service_time=service)
             except Exception as e:
                 elapsed = round(time.time() - start_time, 3)
-                log_api_event(request_id, "exception", elapsed, True, prompt_preview, error=str(e))
+                service = round(time.time() - service_start, 3)
+                log_api_event(request_id, "exception", elapsed, True, prompt_preview, error=str(e), service_time=service)
             
             # 无论是结构问题或异常，最终都 fallback
             return fallback
@@ -148,26 +177,30 @@ class ApiPromptAsyncProcessor:
         else:
             return value
 
-    async def reasoning_type(self, zh_text, session):
-        prompt = f"""
-        你是一位精通数学文字题的专家，请根据题目的解答推理复杂程度对数学文字题进行分类。分类标准如下：
-        type_1(简单计算)：没有隐含关系，只需简单加减乘除计算即可解题。
-        type_2(单步公式)：可以直接使用数学公式，或者只需进行一步简单转换即可解决。
-        type_3(多步公式)：需要使用数学公式，并且必须经过多步转换才能解决。
+    # 各任务的 prompt 构建与请求分离，dry-run 计划（RunPlanner）复用同一套 prompt
+    def build_reasoning_type_prompt(self, zh_text):
+        return f"""
+        {self.reasoning_type_instruction}
         数学题内容: "{zh_text}"
-        分类选项: [type_1, type_2, type_3]
+        {self.reasoning_type_options}
         请尽量只选择最接近的一个分类，并直接输出分类标签。
         """
+
+    async def reasoning_type(self, zh_text, session):
+        prompt = self.build_reasoning_type_prompt(zh_text)
         return await self.api_call(prompt, session, fallback="type_error", ERROR_INFO="[分类错误]")
 
-    async def translate_text(self, zh_text, session):
-        prompt = f"""
+    def build_translate_text_prompt(self, zh_text):
+        return f"""
         你是一个擅长将中文翻译成英文的专家，而不是解答问题，请将以下中文翻译成英文:\n{zh_text}
         """
+
+    async def translate_text(self, zh_text, session):
+        prompt = self.build_translate_text_prompt(zh_text)
         return await self.api_call(prompt, session, fallback=None, ERROR_INFO="[翻译错误]")
 
-    async def extract_relation(self, zh_text, session):
-        prompt = f"""
+    def build_extract_relation_prompt(self, zh_text):
+        return f"""
         你作为一个数量关系抽取器，从题目中提取实体之间的数量关系，而不是解答问题。
         请确保提取的关系清晰、准确且格式一致，只需直接输出题目文本对应的数量关系即可。
         
@@ -179,12 +212,14 @@ class ApiPromptAsyncProcessor:
         
         题目：{zh_text}
         """
+
+    async def extract_relation(self, zh_text, session):
+        prompt = self.build_extract_relation_prompt(zh_text)
         return await self.api_call(prompt, session, fallback=None, ERROR_INFO="[关系抽取错误]")
 
-    async def problem_category(self, zh_text, session):
-        prompt = f"""
-        你是一位资深小学数学专家，擅长对题目进行结构化分类。请根据题干列出该题目所属的类型（可多选）。
-        请尽量从以下问题分类中选择最接近的一个或多个，并直接输出分类选项：{self.problem_categories}
+    def build_problem_category_prompt(self, zh_text):
+        return f"""
+        {self.problem_category_instruction}，并直接输出分类选项：{self.problem_categories}
         
         示例：
         题目：小明和小红从家出发，分别以每小时 4 千米和 3 千米的速度迎面而行，2 小时后相遇。他们家之间相距多少千米？
@@ -192,12 +227,14 @@ class ApiPromptAsyncProcessor:
 
         题目: {zh_text}
         """
+
+    async def problem_category(self, zh_text, session):
+        prompt = self.build_problem_category_prompt(zh_text)
         return await self.api_call(prompt, session, fallback=None, ERROR_INFO="[题型分类错误]")
 
-    async def knowledge_tag(self, zh_text, session):
-        prompt = f"""
-        你是一位小学数学教师，擅长分析题目所涉及的数学知识点。请根据题干列出其中涵盖的数学知识点（可多选）。
-        请尽量从以下知识点标签中选择最接近的一个或多个，并直接输出知识点标签：{self.knowledge_tags}
+    def build_knowledge_tag_prompt(self, zh_text):
+        return f"""
+        {self.knowledge_tag_instruction}，并直接输出知识点标签：{self.knowledge_tags}
         
         示例：
         题目：妈妈买了 3 条裙子，每条裙子 48 元，一共花了多少钱？
@@ -205,34 +242,202 @@ class ApiPromptAsyncProcessor:
         
         题目：{zh_text}       
         """
+
+    async def knowledge_tag(self, zh_text, session):
+        prompt = self.build_knowledge_tag_prompt(zh_text)
         return await self.api_call(prompt, session, fallback=None, ERROR_INFO="[知识点打标错误]")
 
-    async def process_dataframe_async(self, df: pd.DataFrame) -> pd.DataFrame:
+    def build_packed_prompt(self, task, items):
+        """items: [(编号, 题目)]，要求按编号返回 JSON 数组"""
+        instruction = {
+            "reasoning_type": f"""{self.reasoning_type_instruction}
+        {self.reasoning_type_options}，每道题只选择最接近的一个分类。
+        输出示例：[{{"id": 1, "label": "type_1"}}, {{"id": 2, "label": "type_3"}}]""",
+            "problem_category": f"""{self.problem_category_instruction}：{self.problem_categories}
+        输出示例：[{{"id": 1, "label": ["行程类"]}}, {{"id": 2, "label": ["几何类", "应用题"]}}]""",
+            "knowledge_tag": f"""{self.knowledge_tag_instruction}：{self.knowledge_tags}
+        输出示例：[{{"id": 1, "label": ["乘法", "人民币计算"]}}, {{"id": 2, "label": ["减法"]}}]""",
+        }[task]
+        problems = "\n        ".join(json.dumps({"id": item_id, "题目": zh_text}, ensure_ascii=False) for item_id, zh_text in items)
+        return f"""
+        {instruction}
+
+        以下每行是一道题目（含编号 id）：
+        {problems}
+
+        请只输出一个 JSON 数组，每道题对应一个元素 {{"id": 编号, "label": 结果}}，不要输出其他内容。
+        """
+
+    @staticmethod
+    def parse_packed_response(task, value, item_ids):
+        """
+        将打包请求的 JSON 数组拆分为 {编号: 单题原始结果}
+        缺失、编号重复或不在本批次中、结果类型不符的题目不会出现在返回值中，由调用方单独重发
+        """
+        if not isinstance(value, str):
+            return {}
+
+        # 去掉 ```json 代码块等包裹，只取最外层数组
+        start, end = value.find('['), value.rfind(']')
+        if start == -1 or end <= start:
+            return {}
+        try:
+            items = json.loads(value[start:end + 1])
+        except ValueError:
+            return {}
+        if not isinstance(items, list):
+            return {}
+
+        parsed, duplicated = {}, set()
+        for item in items:
+            if not isinstance(item, dict) or "label" not in item:
+                continue
+            try:
+                item_id = int(item.get("id"))
+            except (TypeError, ValueError):
+                continue
+            if item_id not in item_ids:
+                continue
+            if item_id in parsed:
+                duplicated.add(item_id)
+                continue
+
+            label = item["label"]
+            if task == "reasoning_type":
+                if not isinstance(label, str):
+                    continue
+                parsed[item_id] = label.strip()
+            elif isinstance(label, list):
+                # 转回 JSON 字符串，与单题请求的返回一致，统一交给 clean_api_field 处理
+                parsed[item_id] = json.dumps(label, ensure_ascii=False)
+            elif isinstance(label, str):
+                parsed[item_id] = label
+
+        for item_id in duplicated:
+            parsed.pop(item_id, None)
+        return parsed
+
+    async def packed_call(self, task, zh_texts, session):
+        """一次请求标注多道题，返回 {批次内序号: 单题原始结果}"""
+        items = list(enumerate(zh_texts, start=1))
+        prompt = self.build_packed_prompt(task, items)
+        max_tokens = max(self.max_tokens, self.packed_tokens_per_item * len(items))
+        res = await self.api_call(prompt, session, fallback=None, ERROR_INFO="[打包请求错误]", max_tokens=max_tokens)
+        parsed = self.parse_packed_response(task, res, set(range(1, len(items) + 1)))
+        return {item_id - 1: label for item_id, label in parsed.items()}
+
+    async def run_task(self, task, zh_texts, session):
+        """
+        执行标签任务，返回与 zh_texts 对齐的原始结果
+        配置了打包（K > 1）时每 K 道题合并为一个请求，缺失或错位的题目再单独请求
+        """
+        single = getattr(self, task)
+        k = self.pack_sizes.get(task, 1)
+        if k <= 1 or len(zh_texts) <= 1:
+            return await asyncio.gather(*[single(q, session) for q in zh_texts])
+
+        chunks = [list(range(start, min(start + k, len(zh_texts)))) for start in range(0, len(zh_texts), k)]
+        packed_res = await asyncio.gather(*[self.packed_call(task, [zh_texts[i] for i in chunk], session) for chunk in chunks])
+
+        results, missing_idx = [None] * len(zh_texts), []
+        for chunk, parsed in zip(chunks, packed_res):
+            for pos, i in enumerate(chunk):
+                if pos in parsed:
+                    results[i] = parsed[pos]
+                else:
+                    missing_idx.append(i)
+
+        logging.info(f"[ApiPromptAsync.run_task] {task} 打包请求 {len(chunks)} 个（K={k}），缺失或错位 {len(missing_idx)} 题单独重发")
+        retry_res = await asyncio.gather(*[single(zh_texts[i], session) for i in missing_idx])
+        for i, r in zip(missing_idx, retry_res):
+            results[i] = r
+
+        return results
+
+    async def match_labels(self, field: str, values: list, zh_texts: list, session) -> list:
+        """
+        将 problem_category / knowledge_tag 整列映射为标准标签
+        仍无法映射的行（含 fallback=None）只针对这些行重新请求，最多 max_reask 轮
+        """
+        matcher = self.label_matchers[field]
+        task = getattr(self, field)
+        matched, unmatched_idx = matcher.match_column(values)
+
+        for attempt in range(1, self.max_reask + 1):
+            if not unmatched_idx:
+                break
+            logging.info(f"[ApiPromptAsync.match_labels] {field} 第 {attempt} 轮定向重新请求，行数: {len(unmatched_idx)}")
+
+            retry_res = await asyncio.gather(*[task(zh_texts[i], session) for i in unmatched_idx])
+            retry_matched, still_idx = matcher.match_column(self.clean_api_field(r, "list") for r in retry_res)
+
+            for i, labels in zip(unmatched_idx, retry_matched):
+                if labels:
+                    matched[i] = labels
+            unmatched_idx = [unmatched_idx[j] for j in still_idx]
+
+        if unmatched_idx:
+            logging.warning(f"[ApiPromptAsync.match_labels] {field} 仍有 {len(unmatched_idx)} 行无法映射为标准标签，保留原始结果")
+            # 保留清洗后的原始结果，便于人工排查
+            for i in unmatched_idx:
+                matched[i] = values[i]
+
+        return matched
+
+    @staticmethod
+    def merge_results(values: list, row_idx: list, results: list) -> list:
+        """将部分行的请求结果按行位置写回整列"""
+        values = list(values)
+        for i, r in zip(row_idx, results):
+            values[i] = r
+        return values
+
+    async def process_dataframe_async(self, df: pd.DataFrame, local_masks: dict = None) -> pd.DataFrame:
+        """
+        local_masks: 本地预标注结果（LocalPrelabel.local_prelabeling 返回），
+                     {field: [bool]}，为 True 的行已有本地标签，不再请求该字段
+        """
         logging.info("[ApiPromptAsync.process_dataframe_async] 启动异步批量处理流程")
 
-        df = df.copy()
+        df = df.copy(deep=False)
+        zh_texts = df["zh_text"].tolist()
+        local_masks = local_masks or {}
+
+        # 各标签字段需要请求 API 的行位置
+        api_idx = {}
+        for field in ("reasoning_type", "problem_category", "knowledge_tag"):
+            mask = local_masks.get(field) or [False] * len(zh_texts)
+            api_idx[field] = [i for i, use_local in enumerate(mask) if not use_local]
+            if len(api_idx[field]) < len(zh_texts):
+                logging.info(f"[ApiPromptAsync.process_dataframe_async] {field} 使用本地标签 {len(zh_texts) - len(api_idx[field])} 行，请求 API {len(api_idx[field])} 行")
+
         async with aiohttp.ClientSession() as session:
-            reasoning_tasks = [self.reasoning_type(q, session) for q in df["zh_text"]]
-            translate_tasks = [self.translate_text(q, session) for q in df["zh_text"]]
-            extract_tasks = [self.extract_relation(q, session) for q in df["zh_text"]]
-            category_tasks = [self.problem_category(q, session) for q in df["zh_text"]]
-            tag_tasks = [self.knowledge_tag(q, session) for q in df["zh_text"]]
+            translate_tasks = [self.translate_text(q, session) for q in zh_texts]
+            extract_tasks = [self.extract_relation(q, session) for q in zh_texts]
 
-            # 异步执行所有任务
+            # 异步执行所有任务（标签任务按 [Packing] 配置打包）
             reasoning_res, en_res, relation_res, category_res, tag_res = await asyncio.gather(
-                asyncio.gather(*reasoning_tasks),
+                self.run_task("reasoning_type", [zh_texts[i] for i in api_idx["reasoning_type"]], session),
                 asyncio.gather(*translate_tasks),
                 asyncio.gather(*extract_tasks),
-                asyncio.gather(*category_tasks),
-                asyncio.gather(*tag_tasks),
+                self.run_task("problem_category", [zh_texts[i] for i in api_idx["problem_category"]], session),
+                self.run_task("knowledge_tag", [zh_texts[i] for i in api_idx["knowledge_tag"]], session),
             )
             
             # 应用清洗函数
-            df["reasoning_type"] = reasoning_res
+            category_res = [self.clean_api_field(c, "list") for c in category_res]
+            tag_res = [self.clean_api_field(t, "list") for t in tag_res]
+
+            # 标签规范化：映射为标准标签，并对无法映射的行定向重新请求（本地标签已是标准标签，无需处理）
+            if self.label_matching:
+                category_res = await self.match_labels("problem_category", category_res, [zh_texts[i] for i in api_idx["problem_category"]], session)
+                tag_res = await self.match_labels("knowledge_tag", tag_res, [zh_texts[i] for i in api_idx["knowledge_tag"]], session)
+
+            df["reasoning_type"] = self.merge_results(df["reasoning_type"], api_idx["reasoning_type"], reasoning_res)
             df["en_text"] = en_res
             df["quantity_relation"] = [self.clean_api_field(r, "dict") for r in relation_res]
-            df["problem_category"] = [self.clean_api_field(c, "list") for c in category_res]
-            df["knowledge_tag"] = [self.clean_api_field(t, "list") for t in tag_res]
+            df["problem_category"] = self.merge_results(df["problem_category"], api_idx["problem_category"], category_res)
+            df["knowledge_tag"] = self.merge_results(df["knowledge_tag"], api_idx["knowledge_tag"], tag_res)
         
         logging.info("[ApiPromptAsync.process_dataframe_async] 所有字段api_call处理完成")
 
@@ -242,10 +447,12 @@ class ApiPromptAsyncProcessor:
 #     processor = ApiPromptAsyncProcessor(config)
 #     return asyncio.run(processor.process_dataframe_async(df))
 
-import nest_asyncio
-nest_asyncio.apply()  # 必须在 get_event_loop 之前执行
-    
-def api_prompt_async(df: pd.DataFrame, config: configparser.ConfigParser) -> pd.DataFrame:
+@profile_hook("api_prompt_async")
+def api_prompt_async(df: pd.DataFrame, config: configparser.ConfigParser, local_masks: dict = None) -> pd.DataFrame:
+    # 仅在真正发起异步处理时才 patch 事件循环，避免 import 本模块时产生副作用
+    import nest_asyncio
+    nest_asyncio.apply()  # 必须在 get_event_loop 之前执行
+
     processor = ApiPromptAsyncProcessor(config)
     loop = asyncio.get_event_loop()
-    return loop.run_until_complete(processor.process_dataframe_async(df))	
\ No newline at end of file
+    return loop.run_until_complete(processor.process_dataframe_async(df, local_masks))	
\ No newline at end of file
@@ -1,10 +1,12 @@
 import pandas as pd
-from config_utils import get_section_dict
+from config_utils import get_section_dict, get_config_value
 import openai
 import configparser
 import re
 import json
 from log_utils import log_api_event
+from label_utils import build_label_matchers
+from profile_utils import profile_hook
 import logging
 import time
 
@@ -30,6 +32,11 @@ class ApiPromptSyncProcessor:
         self.problem_categories = prompt_cfg['problem_categories']
         self.knowledge_tags = prompt_cfg['knowledge_tags']
 
+        # 读取Label_Matching配置：将返回结果映射为标准标签，仅对无法映射的行定向重新请求
+        self.label_matching = get_config_value(config, 'Label_Matching', 'enable', fallback=False)
+        self.max_reask = get_config_value(config, 'Label_Matching', 'max_reask', fallback=1)
+        self.label_matchers = build_label_matchers(config) if self.label_matching else {}
+
     # 构建请求
     def api_call(self, prompt):
         self.call_count += 1  # 请求计数器加一
@@ -52,7 +59,7 @@ class ApiPromptSyncProcessor:
             
             if "choices" in response:
                 # 成功返回时不传prompt_preview，失败时prompt_preview用于追踪
-                log_api_event(request_id, "success", elapsed, False)
+                log_api_event(request_id, "success", elapsed, False, service_time=elapsed)
                 return response.choices[0].message.content.strip()
             
             # 结构错误但没有触发异常
@@ -60,11 +67,11 @@ class ApiPromptSyncProcessor:
             # res 是 dict，先将它转成 JSON 字符串
             bad_res_str = json.dumps(response, ensure_ascii=False)
             prompt_preview = bad_res_str[-30:] if len(bad_res_str) > 30 else bad_res_str
-            log_api_event(request_id, "bad_response", elapsed, True, prompt_preview)
+            log_api_event(request_id, "bad_response", elapsed, True, prompt_preview, service_time=elapsed)
             
         except Exception as e:
             elapsed = round(time.time() - start_time, 3)
-            log_api_event(request_id, "exception", elapsed, True, prompt_preview, error=str(e))
+            log_api_event(request_id, "exception", elapsed, True, prompt_preview, error=str(e), service_time=elapsed)
         return None
 
     # 清理api-response字符串中多余的转义符和换行，并转换为实际 Python 对象
@@ -198,10 +205,35 @@ class ApiPromptSyncProcessor:
         """
         return self.api_call(prompt)
 
+    def match_labels(self, field: str, values: list, zh_texts: list) -> list:
+        """将整列映射为标准标签，仅对无法映射的行重新请求，最多 max_reask 轮"""
+        matcher = self.label_matchers[field]
+        task = getattr(self, field)
+        matched, unmatched_idx = matcher.match_column(values)
+
+        for attempt in range(1, self.max_reask + 1):
+            if not unmatched_idx:
+                break
+            logging.info(f"[ApiPromptSync.match_labels] {field} 第 {attempt} 轮定向重新请求，行数: {len(unmatched_idx)}")
+
+            retry_matched, still_idx = matcher.match_column(self.clean_api_field(task(zh_texts[i]), "list") for i in unmatched_idx)
+
+            for i, labels in zip(unmatched_idx, retry_matched):
+                if labels:
+                    matched[i] = labels
+            unmatched_idx = [unmatched_idx[j] for j in still_idx]
+
+        if unmatched_idx:
+            logging.warning(f"[ApiPromptSync.match_labels] {field} 仍有 {len(unmatched_idx)} 行无法映射为标准标签，保留原始结果")
+            for i in unmatched_idx:
+                matched[i] = values[i]
+
+        return matched
+
     def process_dataframe_sync(self, df: pd.DataFrame) -> pd.DataFrame:
         logging.info("[ApiPromptSync.process_dataframe_sync] 开始处理 DataFrame")
 
-        df = df.copy()
+        df = df.copy(deep=False)
         
         logging.info("开始推理类型识别")
         df["reasoning_type"] = df["zh_text"].apply(self.reasoning_type)
@@ -217,10 +249,17 @@ class ApiPromptSyncProcessor:
 
         logging.info("开始知识点标记")
         df["knowledge_tag"] = df["zh_text"].apply(self.knowledge_tag).apply(lambda x: self.clean_api_field(x, field_type="list"))
+
+        if self.label_matching:
+            logging.info("开始标签规范化匹配")
+            zh_texts = df["zh_text"].tolist()
+            df["problem_category"] = self.match_labels("problem_category", df["problem_category"].tolist(), zh_texts)
+            df["knowledge_tag"] = self.match_labels("knowledge_tag", df["knowledge_tag"].tolist(), zh_texts)
         
         logging.info("[ApiPromptSync.process_dataframe_sync] 所有字段api_call处理完成")
         return df
 
+@profile_hook("api_prompt_sync")
 def api_prompt_sync(df: pd.DataFrame, config: configparser.ConfigParser) -> pd.DataFrame:
     processor = ApiPromptSyncProcessor(config)
     return processor.process_dataframe_sync(df)
\ No newline at end of file
@@ -3,18 +3,27 @@ import sympy as sp
 import re
 import logging
 import json
+import configparser
+from config_utils import get_config_value
 from typing import List, Tuple
-import jieba
 from collections import defaultdict
+from segment_utils import SegmentEngine
+from schema_utils import to_records
+from profile_utils import profiler, profile_hook
 
 class DataPostprocessor:
-    def __init__(self):
+    def __init__(self, segmenter: SegmentEngine = None, reuse_source_segmentation: bool = False):
         # 正则表达式：处理百分号
         self.percent_pattern = r'(\d+(\.\d+)?)%'
+
+        # 分词引擎（延迟加载 jieba）；是否复用数据源中已有的 segmented_text（如 APE）
+        self.segmenter = segmenter or SegmentEngine()
+        self.reuse_source_segmentation = reuse_source_segmentation
     
+    @profile_hook("DataPostprocessor.format_dataframe")
     def format_dataframe(self, df: pd.DataFrame) -> pd.DataFrame:
         logging.info("[DataPostprocessor.format_dataframe] 开始格式化数学表达式")
-        df = df.copy()
+        df = df.copy(deep=False)
         formatted_records = []
 
         for item in df.to_dict(orient='records'):
@@ -71,6 +80,7 @@ class DataPostprocessor:
         return pd.DataFrame(formatted_records)
 
 
+    @profile_hook("DataPostprocessor.tokenize_std_export")
     def tokenize_std_export(self, df: pd.DataFrame, source_list: List[Tuple[str, str]], data_output: str) -> None:
         logging.info("[DataPostprocessor.tokenize_std_export] 开始分词与编号处理")
 
@@ -81,10 +91,20 @@ class DataPostprocessor:
         if "zh_text" not in df.columns:
             logging.error("[DataPostprocessor.tokenize_std_export] DataFrame 中缺少 'zh_text' 字段，无法进行分词。")
 
-        df = df.copy()
+        df = df.copy(deep=False)
+
+        # 1、分词：批量分词，已有 segmented_text 的行（可选）直接复用
+        zh_texts = df["zh_text"].tolist()
+        segmented = df["segmented_text"].tolist() if "segmented_text" in df.columns else [None] * len(df)
+        if not self.reuse_source_segmentation:
+            segmented = [None] * len(df)
 
-        # 1、分词：
-        df["segmented_text"] = df["zh_text"].apply(lambda x: " ".join(jieba.cut(x, cut_all=False)))
+        need_idx = [i for i, seg in enumerate(segmented) if not (isinstance(seg, str) and seg.strip())]
+        logging.info(f"[DataPostprocessor.tokenize_std_export] 复用已有分词 {len(df) - len(need_idx)} 条，需要分词 {len(need_idx)} 条")
+
+        for i, seg in zip(need_idx, self.segmenter.segment_batch([zh_texts[i] for i in need_idx])):
+            segmented[i] = seg
+        df["segmented_text"] = segmented
         
         # 2、编号：range(1, len(df) + 1) 从 1 开始编号 并替换原 id 列
         df["id"] = range(1, len(df) + 1)
@@ -100,17 +120,17 @@ class DataPostprocessor:
                 "description": "This is a benchmark dataset for math question.",
                 "original_language": "Chinese"
             },
-            "body": df.to_dict(orient='records')
+            "body": to_records(df)
         }
         
         try:
-            with open(data_output, 'w', encoding='utf-8') as f:
+            with profiler.stage("DataPostprocessor.json_dump", len(df)), open(data_output, 'w', encoding='utf-8') as f:
                 json.dump(result_json, f, ensure_ascii=False, indent=4)
             logging.info(f"[DataPostprocessor.tokenize_std_export] 成功写入文件: {data_output}")
         except Exception as e:
             logging.error(f"[DataPostprocessor.tokenize_std_export] 写入文件失败: {e}")
 
-def data_postprocessing(df: pd.DataFrame, source_list: List[Tuple[str, str]], data_output: str) -> None:
+def data_postprocessing(df: pd.DataFrame, source_list: List[Tuple[str, str]], data_output: str, config: configparser.ConfigParser = None) -> None:
     """
     格式化数学表达式并进行分词与编号处理，并以标准格式写入 JSON 文件
 
@@ -118,11 +138,18 @@ def data_postprocessing(df: pd.DataFrame, source_list: List[Tuple[str, str]], da
         df: 包含 'zh_text' 和 'equation' 字段的 DataFrame
         source_list: [(filename, source)] 元组列表
         data_output: JSON 输出文件路径
+        config: 可选，读取 [Segmentation] 分词配置；为 None 时使用默认分词器且不持久化缓存
     """
     logging.info("[DataPostprocessor] 开始处理数据")
 
-    formatter = DataPostprocessor()
+    segmenter = SegmentEngine.from_config(config) if config is not None else SegmentEngine()
+    reuse = get_config_value(config, 'Segmentation', 'reuse_source_segmentation', fallback=False) if config is not None else False
+
+    formatter = DataPostprocessor(segmenter, reuse)
     df_formatter = formatter.format_dataframe(df)
 
     # 进行分词与编号处理 格式化输出到 JSON 文件
-    formatter.tokenize_std_export(df_formatter, source_list, data_output)
\ No newline at end of file
+    try:
+        formatter.tokenize_std_export(df_formatter, source_list, data_output)
+    finally:
+        segmenter.close()
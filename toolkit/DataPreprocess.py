@@ -4,6 +4,7 @@ import pandas as pd
 import re
 import configparser
 from config_utils import get_section_dict
+from profile_utils import profiler, profile_hook
 import logging
 
 class DataPreprocessor:
@@ -30,6 +31,7 @@ class DataPreprocessor:
         return df.reindex(columns=self.target_fields)
 
     # 题目筛选
+    @profile_hook("DataPreprocessor.filter_math_questions")
     def filter_math_questions(self, df: pd.DataFrame) -> pd.DataFrame:
         # 匹配仅包含数字、空格、运算符、括号（纯数学表达式）
         pure_math_pattern = re.compile(r'^[\d\s\-+*/().]+[\d\s\-+*/().]*[^\u4e00-\u9fa5]*$')
@@ -43,6 +45,7 @@ class DataPreprocessor:
         return df.reset_index(drop=True)
 
     # 读取每个文件及其指定的 source 值（支持结构 A（带 head 和 body）和结构 B（不带 head，直接是 list））
+    @profile_hook("DataPreprocessor.load_files_with_sources")
     def load_files_with_sources(self, file_source_list: list, folder_path: str) -> pd.DataFrame:
         logging.info("[dataPreprocess.load_files_with_sources] 开始加载数据文件...")
         all_dfs = []
@@ -50,7 +53,7 @@ class DataPreprocessor:
         for filename, source_value in file_source_list:
             full_path = os.path.join(folder_path, filename)
             try:
-                with open(full_path, 'r', encoding='utf-8') as f:
+                with profiler.stage(f"DataPreprocessor.json_load[{filename}]"), open(full_path, 'r', encoding='utf-8') as f:
                     data = json.load(f)
 
                 if isinstance(data, dict) and 'body' in data:
@@ -0,0 +1,283 @@
+import os
+import json
+import hashlib
+import logging
+import configparser
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.calibration import CalibratedClassifierCV
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.linear_model import LogisticRegression
+from sklearn.multiclass import OneVsRestClassifier
+from sklearn.preprocessing import MultiLabelBinarizer
+from config_utils import get_section_dict
+from profile_utils import profile_hook
+
+class LocalPrelabeler:
+    """
+    本地 CPU 预标注：用历史流水线输出训练字符 n-gram TF-IDF + 线性分类器
+
+    - reasoning_type：多分类 LogisticRegression，置信度取最大类别概率
+    - problem_category / knowledge_tag：OneVsRest LogisticRegression，置信度取输出标签的 p 与未输出标签的 1-p 中的最小值
+    分类器均经 CalibratedClassifierCV 交叉校准（概率由训练集的折外预测拟合），
+    校准后的置信度不低于阈值的行直接使用本地标签，其余行仍交给 API 处理
+    拟合结果按训练文件和训练参数的指纹缓存（joblib），训练数据不变时直接复用，不再重新训练
+    """
+
+    # 预标注字段及其类型：single 单标签，multi 多标签
+    label_fields = {
+        "reasoning_type": "single",
+        "problem_category": "multi",
+        "knowledge_tag": "multi",
+    }
+    reasoning_types = ["type_1", "type_2", "type_3"]
+
+    # 通过统一接口读取配置文件
+    def __init__(self, config: configparser.ConfigParser):
+        local_cfg = get_section_dict(config, 'Local_Prelabel')
+        self.train_files = local_cfg['train_files']
+        self.confidence_threshold = local_cfg.get('confidence_threshold', 0.9)
+        self.holdout_ratio = local_cfg.get('holdout_ratio', 0.1)
+        self.ngram_range = tuple(local_cfg.get('ngram_range', (1, 3)))
+        self.max_features = local_cfg.get('max_features', 200000)
+        self.random_state = local_cfg.get('random_state', 42)
+        self.calibration_method = local_cfg.get('calibration_method', 'sigmoid')
+        self.calibration_folds = local_cfg.get('calibration_folds', 3)
+        self.model_cache = local_cfg.get('model_cache') or None
+
+        # 只学习预定义的标准标签，历史输出中的非标准标签不参与训练
+        prompt_cfg = get_section_dict(config, 'Prompt_Labels')
+        self.allowed_labels = {
+            "reasoning_type": set(self.reasoning_types),
+            "problem_category": set(prompt_cfg['problem_categories']),
+            "knowledge_tag": set(prompt_cfg['knowledge_tags']),
+        }
+
+        self.vectorizer = None
+        self.models = {}
+        self.binarizers = {}
+
+    # 读取历史流水线输出（DataPostprocess 导出的 head/body 格式，或直接为 list）
+    def load_training_data(self) -> pd.DataFrame:
+        records = []
+        for path in self.train_files:
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                body = data['body'] if isinstance(data, dict) and 'body' in data else data
+                records.extend(body)
+                logging.info(f"[LocalPrelabel.load_training_data] 成功读取训练文件: {path}，记录数: {len(body)}")
+            except Exception as e:
+                logging.error(f"[LocalPrelabel.load_training_data] 训练文件读取失败：{path} → {e}")
+
+        columns = ["zh_text"] + list(self.label_fields)
+        train_df = pd.DataFrame(records).reindex(columns=columns)
+        train_df = train_df[train_df["zh_text"].apply(lambda x: isinstance(x, str) and bool(x))]
+        return train_df.drop_duplicates("zh_text").reset_index(drop=True)
+
+    def _clean_labels(self, field: str, value):
+        """过滤为标准标签：single 返回标签或 None，multi 返回标签列表（可能为空）"""
+        allowed = self.allowed_labels[field]
+        if self.label_fields[field] == "single":
+            return value if isinstance(value, str) and value in allowed else None
+        if not isinstance(value, list):
+            return []
+        return [v for v in value if isinstance(v, str) and v in allowed]
+
+    def _calibrated(self, estimator) -> CalibratedClassifierCV:
+        return CalibratedClassifierCV(estimator, method=self.calibration_method, cv=self.calibration_folds)
+
+    def _predict_field(self, field: str, X) -> tuple:
+        """返回 (labels, 校准后的 confidence)"""
+        model = self.models[field]
+        proba = model.predict_proba(X)
+
+        if self.label_fields[field] == "single":
+            best = proba.argmax(axis=1)
+            return list(model.classes_[best]), proba.max(axis=1)
+
+        classes = self.binarizers[field].classes_
+        # 输出概率 ≥ 0.5 的标签；都不足 0.5 时仍输出概率最大的一个
+        chosen = proba >= 0.5
+        none_chosen = ~chosen.any(axis=1)
+        chosen[none_chosen, proba[none_chosen].argmax(axis=1)] = True
+        labels = [[classes[j] for j in np.flatnonzero(row)] for row in chosen]
+        # 置信度描述实际输出的标签集合：输出的标签取 p，未输出的取 1-p，再取最小值
+        # （被强制输出的标签 p < 0.5，这类行的置信度必然低于阈值，交给 API 处理）
+        confidence = np.where(chosen, proba, 1 - proba).min(axis=1)
+        return labels, confidence
+
+    def fingerprint(self) -> str:
+        """训练文件（路径 + 修改时间 + 大小）与训练参数的指纹，任一变化后模型缓存自动失效"""
+        files = []
+        for path in self.train_files:
+            stat = os.stat(path) if os.path.isfile(path) else None
+            files.append([os.path.abspath(path), stat.st_mtime_ns if stat else None, stat.st_size if stat else None])
+        params = [self.holdout_ratio, list(self.ngram_range), self.max_features, self.random_state,
+                  self.calibration_method, self.calibration_folds,
+                  {field: sorted(labels) for field, labels in self.allowed_labels.items()}]
+        raw = json.dumps([files, params], ensure_ascii=False, sort_keys=True)
+        return hashlib.md5(raw.encode('utf-8')).hexdigest()[:12]
+
+    def load_model(self) -> bool:
+        """读取与当前指纹匹配的模型缓存，成功返回 True"""
+        if not self.model_cache:
+            return False
+        cache_path = f"{self.model_cache}.{self.fingerprint()}"
+        if not os.path.isfile(cache_path):
+            return False
+        try:
+            self.vectorizer, self.models, self.binarizers = joblib.load(cache_path)
+            logging.info(f"[LocalPrelabel.load_model] 训练数据未变化，复用模型缓存: {cache_path}")
+            return True
+        except Exception as e:
+            logging.warning(f"[LocalPrelabel.load_model] 模型缓存读取失败，重新训练: {cache_path} → {e}")
+            return False
+
+    def save_model(self):
+        if not self.model_cache:
+            return
+        cache_path = f"{self.model_cache}.{self.fingerprint()}"
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            joblib.dump((self.vectorizer, self.models, self.binarizers), tmp_path)
+            os.replace(tmp_path, cache_path)
+            logging.info(f"[LocalPrelabel.save_model] 已写入模型缓存: {cache_path}")
+        except Exception as e:
+            logging.warning(f"[LocalPrelabel.save_model] 模型缓存写入失败: {cache_path} → {e}")
+
+    def fit(self, train_df: pd.DataFrame) -> dict:
+        """
+        在训练集上拟合（训练数据与参数未变时复用模型缓存），
+        并在留出集上评估置信行的覆盖率和与历史标签的一致率
+        """
+        rng = np.random.default_rng(self.random_state)
+        holdout_mask = rng.random(len(train_df)) < self.holdout_ratio
+        fit_df, holdout_df = train_df[~holdout_mask], train_df[holdout_mask]
+
+        if not self.load_model():
+            self._train(fit_df)
+            self.save_model()
+
+        X_holdout = self.vectorizer.transform(holdout_df["zh_text"]) if len(holdout_df) else None
+        report = {field: self._evaluate(field, X_holdout, holdout_df) for field in self.models}
+
+        logging.info(json.dumps({"event": "local_prelabel_fit", "train_size": len(fit_df), "holdout_size": len(holdout_df), "holdout": report}, ensure_ascii=False))
+        return report
+
+    def _train(self, fit_df: pd.DataFrame):
+        logging.info(f"[LocalPrelabel.fit] 开始训练本地分类器，样本数: {len(fit_df)}")
+
+        self.vectorizer = TfidfVectorizer(
+            analyzer="char_wb",
+            ngram_range=self.ngram_range,
+            max_features=self.max_features,
+            sublinear_tf=True
+        )
+        X_fit = self.vectorizer.fit_transform(fit_df["zh_text"])
+
+        for field, kind in self.label_fields.items():
+            cleaned = [self._clean_labels(field, v) for v in fit_df[field]]
+
+            # 交叉校准按类别分层切分，每个类别（多标签时每个标签的正、负样本）至少需要 calibration_folds 个
+            min_count = self.calibration_folds
+            if kind == "single":
+                counts = pd.Series([v for v in cleaned if v]).value_counts()
+                frequent = set(counts.index[counts >= min_count])
+                keep = [v in frequent for v in cleaned]
+                y = [v for v in cleaned if v in frequent]
+                if len(frequent) < 2:
+                    logging.warning(f"[LocalPrelabel.fit] {field} 样本数足够校准的类别不足 2 个，跳过该字段")
+                    continue
+                model = self._calibrated(LogisticRegression(max_iter=1000))
+                model.fit(X_fit[np.flatnonzero(keep)], y)
+            else:
+                keep = [bool(v) for v in cleaned]
+                y = [v for v in cleaned if v]
+                binarizer = MultiLabelBinarizer()
+                Y = binarizer.fit_transform(y)
+                # 每个标签都需要足够的正负样本，去掉训练集中过少或过多出现的标签
+                valid = (Y.sum(axis=0) >= min_count) & (len(Y) - Y.sum(axis=0) >= min_count)
+                if not valid.any():
+                    logging.warning(f"[LocalPrelabel.fit] {field} 可用标签不足，跳过该字段")
+                    continue
+                binarizer = MultiLabelBinarizer(classes=list(binarizer.classes_[valid]))
+                Y = binarizer.fit_transform(y)
+                model = OneVsRestClassifier(self._calibrated(LogisticRegression(solver="liblinear")))
+                model.fit(X_fit[np.flatnonzero(keep)], Y)
+                self.binarizers[field] = binarizer
+            self.models[field] = model
+
+    def _evaluate(self, field: str, X_holdout, holdout_df: pd.DataFrame) -> dict:
+        if X_holdout is None:
+            return {"evaluated": 0}
+
+        truth = [self._clean_labels(field, v) for v in holdout_df[field]]
+        labels, confidence = self._predict_field(field, X_holdout)
+
+        confident = [i for i, t in enumerate(truth) if t and confidence[i] >= self.confidence_threshold]
+        evaluated = sum(1 for t in truth if t)
+        if self.label_fields[field] == "single":
+            agree = sum(1 for i in confident if labels[i] == truth[i])
+        else:
+            agree = sum(1 for i in confident if set(labels[i]) == set(truth[i]))
+
+        return {
+            "evaluated": evaluated,
+            "coverage": round(len(confident) / evaluated, 4) if evaluated else 0.0,
+            "agreement": round(agree / len(confident), 4) if confident else None,
+        }
+
+    def predict(self, df: pd.DataFrame) -> tuple:
+        """
+        对新数据预标注，返回 (df, local_masks)
+        local_masks[field][i] 为 True 表示第 i 行已使用本地标签，不再请求 API
+        """
+        df = df.copy(deep=False)
+        n = len(df)
+        local_masks = {field: [False] * n for field in self.label_fields}
+        if n == 0 or self.vectorizer is None:
+            return df, local_masks
+
+        X = self.vectorizer.transform(df["zh_text"])
+        for field in self.models:
+            labels, confidence = self._predict_field(field, X)
+            mask = [bool(c >= self.confidence_threshold) for c in confidence]
+            values = df[field].tolist()
+            for i, use_local in enumerate(mask):
+                if use_local:
+                    values[i] = labels[i]
+            df[field] = values
+            local_masks[field] = mask
+
+        saved = {field: sum(mask) for field, mask in local_masks.items()}
+        logging.info(json.dumps({
+            "event": "local_prelabel",
+            "rows": n,
+            "threshold": self.confidence_threshold,
+            "api_calls_saved": saved,
+            "api_calls_saved_total": sum(saved.values()),
+            "api_calls_remaining": n * len(self.label_fields) - sum(saved.values())
+        }, ensure_ascii=False))
+
+        return df, local_masks
+
+@profile_hook("local_prelabeling")
+def local_prelabeling(df: pd.DataFrame, config: configparser.ConfigParser) -> tuple:
+    """
+    训练本地分类器并对 df 预标注
+
+    返回：
+        (df, local_masks)：df 中置信行已填入本地标签；local_masks 传给 api_prompt_async，跳过这些行的标签请求
+    """
+    prelabeler = LocalPrelabeler(config)
+    train_df = prelabeler.load_training_data()
+
+    if train_df.empty:
+        logging.warning("[LocalPrelabel] 没有可用的训练数据，跳过本地预标注")
+        return df, {}
+
+    prelabeler.fit(train_df)
+    return prelabeler.predict(df)
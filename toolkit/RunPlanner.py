@@ -0,0 +1,171 @@
+import os
+import glob
+import json
+import math
+import sqlite3
+import logging
+import configparser
+import pandas as pd
+from config_utils import get_section_dict, get_config_value
+from ApiPromptAsync import ApiPromptAsyncProcessor
+
+class RunPlanner:
+    """
+    dry-run 计划：按 ApiPromptAsyncProcessor 五个任务方法的方式构建全部 prompt，但不发送任何请求
+    估算每个任务的请求数、prompt / completion token、API 响应缓存命中（当前无响应缓存，报告为 null）、分词缓存命中，以及按历史请求服务时间和并发度推算的耗时
+    """
+
+    tasks = ["reasoning_type", "translate_text", "extract_relation", "problem_category", "knowledge_tag"]
+
+    # 各任务的 completion token 经验估计：固定值，或按题干字符数的倍数（均不超过 max_tokens）
+    completion_fixed = {"reasoning_type": 4, "problem_category": 12, "knowledge_tag": 18}
+    completion_per_char = {"translate_text": 0.9, "extract_relation": 2.5}
+
+    # 每条消息的格式开销（role 等）；打包请求中每道题 {"id": n, "label": ...} 的格式开销
+    message_overhead = 4
+    packed_item_overhead = 10
+
+    # 通过统一接口读取配置文件
+    def __init__(self, config: configparser.ConfigParser):
+        self.config = config
+        self.processor = ApiPromptAsyncProcessor(config)
+        self.max_tokens = self.processor.max_tokens
+        self.max_concurrent = get_config_value(config, 'Processing_Mode', 'max_concurrent_requests', fallback=1)
+
+        self.price_prompt = get_config_value(config, 'Plan', 'price_per_1k_prompt_tokens', fallback=0.0)
+        self.price_completion = get_config_value(config, 'Plan', 'price_per_1k_completion_tokens', fallback=0.0)
+
+        logging_cfg = get_section_dict(config, 'Logging')
+        self.log_pattern = os.path.join(logging_cfg["log_dir"], f"{logging_cfg['log_name']}.jsonl*")
+
+        self._encoder = self._load_encoder(self.processor.model)
+
+    @staticmethod
+    def _load_encoder(model: str):
+        """有 tiktoken 时精确计数，否则退回字符数估算"""
+        try:
+            import tiktoken
+        except ImportError:
+            return None
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+
+    def count_tokens(self, text: str) -> int:
+        if self._encoder is not None:
+            return len(self._encoder.encode(text))
+        # 估算：中日韩字符约 1 token/字，其余字符约 4 字符/token
+        cjk = sum(1 for ch in text if '一' <= ch <= '鿿' or '　' <= ch <= '〿' or '＀' <= ch <= '￯')
+        return cjk + math.ceil((len(text) - cjk) / 4)
+
+    def estimate_completion(self, task: str, zh_text: str) -> int:
+        if task in self.completion_fixed:
+            tokens = self.completion_fixed[task]
+        else:
+            tokens = math.ceil(len(zh_text) * self.completion_per_char[task])
+        return min(tokens, self.max_tokens)
+
+    def load_latencies(self) -> list:
+        """
+        读取历史 api_log.jsonl（含轮转文件）中成功请求的服务时间 service_time
+        elapsed_time 含等待并发信号量的排队时间，再乘以排队轮数会重复计算排队，因此不使用；
+        旧日志没有 service_time 字段，跳过
+        """
+        latencies = []
+        for path in glob.glob(self.log_pattern):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if not line.startswith("{"):
+                        continue
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        continue
+                    if event.get("event") == "api_call" and event.get("status") == "success" and "service_time" in event:
+                        latencies.append(event["service_time"])
+        return latencies
+
+    @staticmethod
+    def percentile(values: list, q: float) -> float:
+        ordered = sorted(values)
+        k = (len(ordered) - 1) * q
+        lo, hi = math.floor(k), math.ceil(k)
+        return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+    def segmentation_cache_hits(self, zh_texts: list) -> int:
+        """统计分词结果缓存（[Segmentation] cache_db）中已存在的题目数"""
+        # 延迟导入，避免 dry-run 加载 jieba
+        from segment_utils import SegmentEngine
+
+        engine = SegmentEngine.from_config(self.config)
+        try:
+            return engine.count_cached(zh_texts)
+        except sqlite3.Error:
+            return 0
+        finally:
+            engine.close()
+
+    def plan(self, df: pd.DataFrame) -> dict:
+        zh_texts = df["zh_text"].tolist()
+        logging.info(f"[RunPlanner.plan] 开始构建 dry-run 计划，样本数量: {len(zh_texts)}")
+
+        per_task = {}
+        for task in self.tasks:
+            k = self.processor.pack_sizes.get(task, 1)
+            if k > 1:
+                # 打包请求：按 K 分批构建 prompt，每道题的 JSON 元素另有编号等格式开销（不含缺失题目的单独重发）
+                chunks = [zh_texts[start:start + k] for start in range(0, len(zh_texts), k)]
+                prompts = [self.processor.build_packed_prompt(task, list(enumerate(chunk, start=1))) for chunk in chunks]
+                completion_tokens = sum(self.estimate_completion(task, q) + self.packed_item_overhead for q in zh_texts)
+            else:
+                build_prompt = getattr(self.processor, f"build_{task}_prompt")
+                prompts = [build_prompt(q) for q in zh_texts]
+                completion_tokens = sum(self.estimate_completion(task, q) for q in zh_texts)
+            per_task[task] = {
+                "requests": len(prompts),
+                "pack_size": k,
+                "prompt_tokens": sum(self.count_tokens(prompt) + self.message_overhead for prompt in prompts),
+                "completion_tokens": completion_tokens,
+            }
+
+        total_requests = sum(t["requests"] for t in per_task.values())
+        total_prompt = sum(t["prompt_tokens"] for t in per_task.values())
+        total_completion = sum(t["completion_tokens"] for t in per_task.values())
+
+        # 耗时推算：所有请求受信号量限制，以 max_concurrent 路并发排队，每轮耗时取单个请求的服务时间
+        latencies = self.load_latencies()
+        if latencies:
+            latency = {f"p{int(q * 100)}": round(self.percentile(latencies, q), 3) for q in (0.5, 0.9, 0.99)}
+            latency["samples"] = len(latencies)
+            waves = total_requests / max(self.max_concurrent, 1)
+            wall_time = {k: round(waves * v, 1) for k, v in latency.items() if k != "samples"}
+        else:
+            latency, wall_time = None, None
+
+        report = {
+            "rows": len(zh_texts),
+            "per_task": per_task,
+            "requests": total_requests,
+            "prompt_tokens": total_prompt,
+            "completion_tokens": total_completion,
+            "token_counter": "tiktoken" if self._encoder is not None else "estimate",
+            "estimated_cost": round(total_prompt / 1000 * self.price_prompt + total_completion / 1000 * self.price_completion, 4),
+            # 预计的 API 响应缓存命中数：当前 API 请求没有响应缓存，全部请求都会实际发送
+            "cache_hits": None,
+            # 后处理阶段分词结果缓存的命中数（与 API 请求无关）
+            "segmentation_cache_hits": self.segmentation_cache_hits(zh_texts),
+            "max_concurrent_requests": self.max_concurrent,
+            "latency_seconds": latency,
+            "projected_wall_seconds": wall_time,
+        }
+
+        if get_config_value(self.config, 'Local_Prelabel', 'enable', fallback=False):
+            report["note"] = "Local_Prelabel 已启用，实际请求数会少于上述估计"
+
+        logging.info(json.dumps({"event": "run_plan", **report}, ensure_ascii=False))
+        return report
+
+def plan_run(df: pd.DataFrame, config: configparser.ConfigParser) -> dict:
+    planner = RunPlanner(config)
+    return planner.plan(df)
@@ -0,0 +1,213 @@
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+# 基准测试脚本：在独立子进程中测量，避免当前进程已导入的模块影响结果
+TOOLKIT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def _timed_import(module: str) -> float:
+    """在全新的解释器中导入 module，返回导入耗时（秒）"""
+    code = f"import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+    out = subprocess.run([sys.executable, "-c", code], cwd=TOOLKIT_DIR, capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+def _timed_command(argv: list) -> float:
+    """运行一条命令（含解释器启动），返回总耗时（秒）"""
+    code = (
+        "import time, subprocess, sys; t = time.perf_counter(); "
+        f"subprocess.run({argv!r}, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL); "
+        "print(time.perf_counter() - t)"
+    )
+    out = subprocess.run([sys.executable, "-c", code], cwd=TOOLKIT_DIR, capture_output=True, text=True, check=True)
+    return float(out.stdout.strip())
+
+def bench_startup(repeat: int = 3) -> dict:
+    """
+    启动耗时基准：
+    - main / 各阶段模块 / 重依赖的导入耗时（取 repeat 次最小值）
+    - `main.py --help` 的端到端耗时
+    """
+    modules = ["main", "config_utils", "log_utils", "DataPreprocess", "ApiPromptSync", "ApiPromptAsync",
+               "DataPostprocess", "segment_utils", "pandas", "openai", "aiohttp", "sympy", "jieba"]
+
+    report = {"import_seconds": {}, "command_seconds": {}}
+    for module in modules:
+        try:
+            report["import_seconds"][module] = round(min(_timed_import(module) for _ in range(repeat)), 4)
+        except subprocess.CalledProcessError:
+            report["import_seconds"][module] = None  # 依赖未安装
+
+    help_cmd = [sys.executable, "main.py", "--help"]
+    report["command_seconds"]["main.py --help"] = round(min(_timed_command(help_cmd) for _ in range(repeat)), 4)
+    return report
+
+def _arrow_allocated() -> int:
+    try:
+        import pyarrow
+        return pyarrow.total_allocated_bytes()
+    except ImportError:
+        return 0
+
+def _traced_build(build) -> tuple:
+    """
+    返回 (build() 的结果, 构建完成后仍被该结果占用的内存字节数)
+    tracemalloc 只追踪 Python 分配器，Arrow 缓冲区由 pyarrow 内存池分配，需单独累加
+    """
+    import gc
+    import tracemalloc
+
+    gc.collect()
+    arrow_before = _arrow_allocated()
+    tracemalloc.start()
+    obj = build()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return obj, size + _arrow_allocated() - arrow_before
+
+def bench_memory(config_path: str, rows: int) -> dict:
+    """
+    内存基准：用配置中的数据源做预处理，补齐模拟的标注字段后扩充到 rows 行，
+    分别以 object 列和紧凑 schema（schema_utils.compact_dataframe）从同一份 JSON 构建 DataFrame，对比内存占用
+    """
+    import random
+    import pandas as pd
+    from config_utils import load_config, get_section_dict
+    from DataPreprocess import data_preprocessing
+    from schema_utils import compact_dataframe
+
+    config = load_config(config_path)
+    datapath_cfg = get_section_dict(config, 'DATAPATH')
+    prompt_cfg = get_section_dict(config, 'Prompt_Labels')
+    base_df = data_preprocessing(config, datapath_cfg["source_list"], datapath_cfg["source_folder"])
+
+    # 模拟标注后的数据：与真实输出相同的字段结构
+    rng = random.Random(0)
+    records = []
+    base = base_df.to_dict(orient='records')
+    for i in range(rows):
+        record = {k: (None if pd.isna(v) else v) if not isinstance(v, (list, dict)) else v for k, v in base[i % len(base)].items()}
+        record["reasoning_type"] = rng.choice(["type_1", "type_2", "type_3"])
+        record["en_text"] = "How many pencils does each child get if the teacher shares them equally?"
+        record["quantity_relation"] = {"铅笔总数 = 35": "总数 = 35", "平均分给孩子们": "每人 = 总数 / 人数"}
+        record["problem_category"] = rng.sample(prompt_cfg['problem_categories'], 2)
+        record["knowledge_tag"] = rng.sample(prompt_cfg['knowledge_tags'], 3)
+        records.append(record)
+    payload = json.dumps(records, ensure_ascii=False)
+    del records, base, base_df
+
+    object_df, object_traced = _traced_build(lambda: pd.DataFrame(json.loads(payload)).astype(object))
+    object_deep = int(object_df.memory_usage(deep=True).sum())
+    del object_df
+
+    compact_df, compact_traced = _traced_build(lambda: compact_dataframe(pd.DataFrame(json.loads(payload))))
+    compact_deep = int(compact_df.memory_usage(deep=True).sum())
+
+    mb = lambda b: round(b / 1024 / 1024, 1)
+    return {
+        "rows": rows,
+        "object_columns": {"traced_mb": mb(object_traced), "memory_usage_deep_mb": mb(object_deep)},
+        "compact_schema": {"traced_mb": mb(compact_traced), "memory_usage_deep_mb": mb(compact_deep)},
+        "dtypes": {col: str(dtype) for col, dtype in compact_df.dtypes.items()},
+        "traced_reduction": round(1 - compact_traced / object_traced, 3) if object_traced else None,
+    }
+
+def _reset_root_logger():
+    import logging
+    from log_utils import shutdown_logging
+
+    shutdown_logging()
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+        handler.close()
+
+def _measure_log_lag(queue_mode: bool, log_dir: str, requests: int, concurrency: int) -> dict:
+    """在事件循环中并发记录 api_call 日志，同时用 1ms 心跳协程测量事件循环延迟"""
+    import time
+    import asyncio
+    from log_utils import setup_logging, shutdown_logging, log_api_event
+
+    _reset_root_logger()
+    # 较小的单文件上限，使测试过程中发生多次轮转
+    setup_logging(log_dir, "bench_queue" if queue_mode else "bench_sync", 2, 3, False, queue_mode)
+
+    async def heartbeat(lags: list, done: asyncio.Event):
+        interval = 0.001
+        while not done.is_set():
+            t = time.perf_counter()
+            await asyncio.sleep(interval)
+            lags.append(time.perf_counter() - t - interval)
+
+    async def worker(start: int, semaphore: asyncio.Semaphore):
+        async with semaphore:
+            for request_id in range(start, start + 10):
+                await asyncio.sleep(0)
+                log_api_event(request_id, "success", 1.234, False)
+
+    async def run() -> tuple:
+        lags, done = [], asyncio.Event()
+        beat = asyncio.create_task(heartbeat(lags, done))
+        semaphore = asyncio.Semaphore(concurrency)
+        t = time.perf_counter()
+        await asyncio.gather(*[worker(i, semaphore) for i in range(0, requests, 10)])
+        elapsed = time.perf_counter() - t
+        done.set()
+        await beat
+        return lags, elapsed
+
+    lags, elapsed = asyncio.run(run())
+    t = time.perf_counter()
+    shutdown_logging()
+    drain = time.perf_counter() - t
+
+    lags.sort()
+    ms = lambda v: round(v * 1000, 3)
+    return {
+        "loop_seconds": round(elapsed, 3),
+        "shutdown_flush_seconds": round(drain, 3),
+        "lag_ms": {"p50": ms(lags[len(lags) // 2]), "p99": ms(lags[int(len(lags) * 0.99)]), "max": ms(lags[-1])} if lags else None,
+    }
+
+def bench_log_lag(requests: int, concurrency: int) -> dict:
+    """事件循环延迟基准：同步写日志 vs 队列模式"""
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as log_dir:
+        report = {
+            "requests": requests,
+            "sync": _measure_log_lag(False, log_dir, requests, concurrency),
+            "queue": _measure_log_lag(True, log_dir, requests, concurrency),
+        }
+        _reset_root_logger()
+    return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="AutoMATH-Dataset 性能基准测试")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    p = subparsers.add_parser("startup", help="启动与导入耗时")
+    p.add_argument("--repeat", type=int, default=3)
+
+    p = subparsers.add_parser("memory", help="流水线 DataFrame 的内存占用：object 列 vs 紧凑 schema")
+    p.add_argument("--config", default="./ToolCodes/pipeline_config.ini")
+    p.add_argument("--rows", type=int, default=170000)
+
+    p = subparsers.add_parser("loglag", help="写日志对事件循环延迟的影响：同步 vs 队列模式")
+    p.add_argument("--requests", type=int, default=50000)
+    p.add_argument("--concurrency", type=int, default=100)
+
+    args = parser.parse_args(argv)
+    if args.command == "startup":
+        report = bench_startup(args.repeat)
+    elif args.command == "memory":
+        report = bench_memory(args.config, args.rows)
+    elif args.command == "loglag":
+        report = bench_log_lag(args.requests, args.concurrency)
+
+    print(json.dumps(report, ensure_ascii=False, indent=4))
+
+if __name__ == "__main__":
+    main()
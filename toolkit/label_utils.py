@@ -0,0 +1,173 @@
+import logging
+import unicodedata
+from collections import deque
+from typing import Any, Iterable
+import configparser
+from config_utils import get_section_dict, get_config_value
+
+class LabelMatcher:
+    """
+    标签规范化匹配器：将模型返回的自由文本映射为预定义的标准标签（problem_categories / knowledge_tags）
+
+    - 初始化时一次性构建索引：精确映射表（标准标签 + 同义词 → 标准标签）+ Aho–Corasick 自动机
+    - 全角/半角、大小写、引号、空白等差异在归一化阶段统一消除（NFKC）
+    - 精确映射命中失败时，用自动机单遍扫描文本，取最长且互不重叠的匹配；
+      只有匹配覆盖整段文本（分隔符除外）时才采用；任一项无命中或只被部分命中（如 加减法 → 减法），整行视为无法映射
+    """
+
+    # 归一化时去除的包裹字符：引号、括号、星号及各类分隔符
+    _strip_chars = " \t\"'`*[]{}()<>“”‘’《》【】「」『』,，、;；:：.。"
+
+    def __init__(self, labels: list, synonyms: dict = None):
+        self.labels = list(labels)
+        self.exact_map = {}
+
+        for label in self.labels:
+            self.exact_map[self.normalize(label)] = label
+
+        # 同义词只能映射到已存在的标准标签，避免引入预定义之外的标签
+        for alias, label in (synonyms or {}).items():
+            if label not in self.labels:
+                logging.warning(f"[LabelMatcher] 同义词 {alias} → {label} 的目标不在标准标签中，已忽略")
+                continue
+            self.exact_map.setdefault(self.normalize(alias), label)
+
+        self._build_automaton()
+
+    @classmethod
+    def normalize(cls, text: str) -> str:
+        """全角 → 半角、统一小写并去除首尾包裹字符"""
+        return unicodedata.normalize("NFKC", text).lower().strip(cls._strip_chars)
+
+    def _build_automaton(self):
+        # goto[state]：字符 → 下一状态；fail[state]：失配跳转；output[state]：(匹配长度, 标准标签)
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+
+        for key, label in self.exact_map.items():
+            if not key:
+                continue
+            state = 0
+            for ch in key:
+                nxt = self.goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[state][ch] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                state = nxt
+            self.output[state].append((len(key), label))
+
+        # 广度优先构建失配指针，并合并后缀状态的输出
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self.goto[state].items():
+                queue.append(nxt)
+                f = self.fail[state]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0)
+                self.output[nxt] = self.output[nxt] + self.output[self.fail[nxt]]
+
+    def _scan_spans(self, text: str) -> list:
+        """单遍扫描已归一化的文本，返回按出现顺序排列、最长且互不重叠的 (start, end, 标准标签)"""
+        hits = []
+        state = 0
+        for end, ch in enumerate(text):
+            while state and ch not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(ch, 0)
+            for length, label in self.output[state]:
+                hits.append((end - length + 1, end + 1, label))
+
+        # 起点优先、同起点取最长，跳过与已选区间重叠的匹配
+        hits.sort(key=lambda h: (h[0], -(h[1] - h[0])))
+        spans, last_end = [], 0
+        for start, end, label in hits:
+            if start >= last_end:
+                spans.append((start, end, label))
+                last_end = end
+        return spans
+
+    def scan(self, text: str) -> list:
+        """单遍扫描文本，返回按出现顺序排列、最长且互不重叠的标准标签"""
+        return [label for _, _, label in self._scan_spans(unicodedata.normalize("NFKC", text).lower())]
+
+    def scan_full(self, text: str) -> list:
+        """
+        扫描文本，仅当匹配覆盖全部非分隔字符时返回标准标签，否则返回空列表
+        例如 "行程类、工程类" → [行程类, 工程类]；"加减法" 只命中 "减法"，"加" 未被覆盖 → []
+        """
+        text = self.normalize(text)
+        spans = self._scan_spans(text)
+        covered = [False] * len(text)
+        for start, end, _ in spans:
+            covered[start:end] = [True] * (end - start)
+        if not spans or any(not c and ch not in self._strip_chars for ch, c in zip(text, covered)):
+            return []
+        return [label for _, _, label in spans]
+
+    def match(self, value: Any) -> list:
+        """
+        将 clean_api_field 的输出映射为标准标签列表（去重且保持顺序）
+
+        - value 为 list：逐项先精确映射，失败再用自动机扫描（兼容 JSON 解析失败后被包为 [原始文本] 的情况）
+        - value 为 str：直接扫描
+        - 任一项无法完整映射（无命中或只被部分匹配，映射会丢失信息）：返回空列表，整行交由调用方标记为未匹配
+        - 其他（None、fallback 等）：返回空列表，交由调用方标记为未匹配
+        """
+        if isinstance(value, str):
+            items = [value]
+        elif isinstance(value, (list, tuple)):
+            items = [v for v in value if isinstance(v, str)]
+        else:
+            return []
+
+        matched = []
+        for item in items:
+            label = self.exact_map.get(self.normalize(item))
+            if label:
+                labels = [label]
+            elif not self.normalize(item):
+                continue  # 只含分隔符的空项
+            else:
+                labels = self.scan_full(item)
+                if not labels:
+                    return []
+            for lab in labels:
+                if lab not in matched:
+                    matched.append(lab)
+        return matched
+
+    def match_column(self, values: Iterable) -> tuple:
+        """
+        批量处理整列数据
+
+        返回 (matched, unmatched_idx)：
+        - matched: 与输入等长的标准标签列表，未匹配的行为空列表
+        - unmatched_idx: 仍无法映射的行位置，用于定向重新请求
+        """
+        matched, unmatched_idx = [], []
+        for i, value in enumerate(values):
+            labels = self.match(value)
+            matched.append(labels)
+            if not labels:
+                unmatched_idx.append(i)
+        return matched, unmatched_idx
+
+def build_label_matchers(config: configparser.ConfigParser) -> dict:
+    """根据 [Prompt_Labels] 与 [Label_Matching] 配置构建 problem_category / knowledge_tag 两个匹配器"""
+    prompt_cfg = get_section_dict(config, 'Prompt_Labels')
+    return {
+        "problem_category": LabelMatcher(
+            prompt_cfg['problem_categories'],
+            get_config_value(config, 'Label_Matching', 'category_synonyms', fallback={})
+        ),
+        "knowledge_tag": LabelMatcher(
+            prompt_cfg['knowledge_tags'],
+            get_config_value(config, 'Label_Matching', 'tag_synonyms', fallback={})
+        ),
+    }
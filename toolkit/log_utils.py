@@ -1,10 +1,112 @@
 import os
 import logging
 import json
+import time
+import queue
+import atexit
+import threading
 from datetime import datetime
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, QueueHandler
 
-def setup_logging(log_dir: str, log_name: str, max_mb: int, backup_count: int, console: bool) -> str:
+try:
+    import orjson  # 可选：更快的 JSON 编码器
+except ImportError:
+    orjson = None
+
+# 队列模式下的后台写日志线程（未启用时为 None）
+_listener = None
+
+class JsonMessageFormatter(logging.Formatter):
+    """
+    结构化事件（dict 消息）在格式化时才序列化为 JSON；队列模式下由后台线程执行
+    use_orjson 仅在队列模式下开启：同步模式保持 json.dumps 的原有输出格式
+    """
+    def __init__(self, fmt: str = None, use_orjson: bool = False):
+        super().__init__(fmt)
+        self.use_orjson = use_orjson and orjson is not None
+
+    def format(self, record: logging.LogRecord) -> str:
+        if isinstance(record.msg, dict):
+            if self.use_orjson:
+                return orjson.dumps(record.msg, default=str).decode('utf-8')
+            return json.dumps(record.msg, default=str)
+        return super().format(record)
+
+class _EnqueueHandler(QueueHandler):
+    """只入队，不在调用线程（事件循环）中格式化或序列化"""
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+class BatchingQueueListener(threading.Thread):
+    """
+    后台线程：从队列攒批取出日志记录，统一序列化后写入各 handler，每批只 flush 一次
+    攒满 batch_size 条，或本批第一条记录等待超过 flush_interval 秒时写出；文件轮转也在此线程中完成，不阻塞事件循环
+    """
+    _stop_signal = object()
+
+    def __init__(self, record_queue: queue.Queue, handlers: list, flush_interval: float, batch_size: int):
+        super().__init__(name="log-writer", daemon=True)
+        self.queue = record_queue
+        self.handlers = handlers
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+
+    def run(self):
+        batch, deadline, stopping = [], None, False
+        while not stopping:
+            # 空批时阻塞等待；已有记录时最多等到本批的写出时间
+            timeout = None if not batch else max(deadline - time.monotonic(), 0)
+            try:
+                record = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                record = None
+
+            if record is self._stop_signal:
+                stopping = True
+            elif record is not None:
+                if not batch:
+                    deadline = time.monotonic() + self.flush_interval
+                batch.append(record)
+
+            if batch and (stopping or len(batch) >= self.batch_size or time.monotonic() >= deadline):
+                self.write_batch(batch)
+                batch = []
+
+    def write_batch(self, batch: list):
+        for handler in self.handlers:
+            records = [r for r in batch if r.levelno >= handler.level]
+            if not records:
+                continue
+
+            handler.acquire()
+            try:
+                for record in records:
+                    try:
+                        line = handler.format(record) + handler.terminator
+                        # 按写入字节数判断轮转，避免 shouldRollover 再次格式化
+                        if isinstance(handler, RotatingFileHandler) and handler.maxBytes > 0:
+                            if handler.stream.tell() + len(line.encode('utf-8')) >= handler.maxBytes:
+                                handler.doRollover()
+                        handler.stream.write(line)
+                    except Exception:
+                        handler.handleError(record)
+                handler.flush()
+            finally:
+                handler.release()
+
+    def stop(self):
+        self.queue.put(self._stop_signal)
+        self.join()
+
+def shutdown_logging():
+    """停止队列模式的后台线程，确保队列中剩余的日志全部写出（进程退出时也会自动调用）"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+def setup_logging(log_dir: str, log_name: str, max_mb: int, backup_count: int, console: bool,
+                  queue_mode: bool = False, flush_interval: float = 0.5, batch_size: int = 256) -> str:
     """
     初始化日志系统，支持控制台输出和文件自动轮转。
     :param log_dir: 日志输出目录
@@ -12,8 +114,13 @@ def setup_logging(log_dir: str, log_name: str, max_mb: int, backup_count: int, c
     :param max_mb: 单个日志文件最大体积（50 MB）
     :param backup_count: 最多保留的轮转日志数量
     :param console: 是否同时输出到控制台
+    :param queue_mode: 是否启用队列模式（日志仅入队，由后台线程批量序列化、写入和轮转）
+    :param flush_interval: 队列模式下日志的最长缓冲时间（秒），到时或攒满 batch_size 条即写入并 flush 一次
+    :param batch_size: 队列模式下每批最多写入的日志条数
     :return: 主日志文件完整路径
     """
+    global _listener
+
     os.makedirs(log_dir, exist_ok=True)
     log_path = os.path.join(log_dir, f"{log_name}.jsonl")
 
@@ -23,29 +130,42 @@ def setup_logging(log_dir: str, log_name: str, max_mb: int, backup_count: int, c
     if console:
         handlers.append(logging.StreamHandler())
 
+    formatter = JsonMessageFormatter("%(message)s", use_orjson=queue_mode)  # 保持结构化 JSON 输出格式
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    if queue_mode:
+        shutdown_logging()
+        record_queue = queue.SimpleQueue()
+        _listener = BatchingQueueListener(record_queue, handlers, flush_interval, batch_size)
+        _listener.start()
+        handlers = [_EnqueueHandler(record_queue)]
+
     logging.basicConfig(
         level=logging.INFO,
         format="%(message)s",  # 保持结构化 JSON 输出格式
         handlers=handlers
     )
 
-    logging.info(json.dumps({
+    logging.info({
         "event": "log_init",
         "log_path": log_path, # "log_path" 属于环境/运行配置
+        "queue_mode": queue_mode,
         "timestamp": datetime.now().isoformat()
-    }))
-    
+    })
+
     return log_path
 
-def log_api_event(request_id, status, elapsed, fallback, prompt_preview="", error=None):
+def log_api_event(request_id, status, elapsed, fallback, prompt_preview="", error=None, service_time=None):
     """
     记录结构化 API 日志事件。
     :param request_id: 请求编号
     :param status: 'success' / 'bad_response' / 'exception'
-    :param elapsed: 耗时（秒）
+    :param elapsed: 耗时（秒），异步模式下包含等待并发信号量的排队时间
     :param fallback: 是否使用 fallback
     :param zh_preview: 中文题目摘要
     :param error: 可选错误信息
+    :param service_time: 可选，取得信号量后请求本身的耗时（秒），不含排队时间
     """
     log_obj = {
         "event": "api_call",
@@ -55,17 +175,23 @@ def log_api_event(request_id, status, elapsed, fallback, prompt_preview="", erro
         "fallback_used": fallback,
         "timestamp": datetime.now().isoformat()
     }
-    
+
     # Only include zh_preview if fallback is used
     if fallback and prompt_preview:
         log_obj["prompt_preview"] = prompt_preview
-            
+
+    if service_time is not None:
+        log_obj["service_time"] = service_time
+
     if error:
         log_obj["error"] = error
 
+    # 直接传入 dict，由 JsonMessageFormatter 序列化（队列模式下不占用事件循环）
     if status == "success":
-        logging.info(json.dumps(log_obj))
+        logging.info(log_obj)
     elif status == "bad_response":
-        logging.warning(json.dumps(log_obj))
+        logging.warning(log_obj)
     else:
-        logging.error(json.dumps(log_obj))
\ No newline at end of file
+        logging.error(log_obj)
+
+atexit.register(shutdown_logging)
@@ -1,65 +1,226 @@
-from config_utils import load_config, get_config_value, get_section_dict
-from log_utils import setup_logging
+import os
+import json
+import argparse
 import logging
+from config_utils import load_config, get_config_value, get_section_dict
+from log_utils import setup_logging, shutdown_logging
+from profile_utils import profiler, profile_hook
+
+# 各阶段模块（pandas、openai、aiohttp、sympy、jieba 等重依赖）只在对应子命令中按需导入，
+# 只跑单个阶段（如仅预处理、仅后处理重新导出）时不必为其他阶段的依赖付出启动时间
 
-from DataPreprocess import data_preprocessing
-from ApiPromptSync import api_prompt_sync
-from ApiPromptAsync import api_prompt_async
-from DataPostprocess import data_postprocessing
+DEFAULT_CONFIG = "./ToolCodes/pipeline_config.ini"
 
-def main():
-    # 1、读取配置文件（相对路径）
-    config = load_config("./ToolCodes/pipeline_config.ini")
-    
+# 阶段间交接文件的默认文件名（位于 [DATAPATH] stage_dir 目录下）
+STAGE_FILES = {
+    "preprocess": "preprocessed.pkl",
+    "annotate": "annotated.pkl",
+}
+
+def init_logging(config):
     # 从配置中读取日志参数
     logging_cfg = get_section_dict(config, 'Logging')
 
     # 初始化日志系统
     log_path = setup_logging(
-        logging_cfg["log_dir"], 
-        logging_cfg["log_name"], 
-        logging_cfg["max_mb"], 
-        logging_cfg["backup_count"], 
-        logging_cfg["console"]
+        logging_cfg["log_dir"],
+        logging_cfg["log_name"],
+        logging_cfg["max_mb"],
+        logging_cfg["backup_count"],
+        logging_cfg["console"],
+        logging_cfg.get("queue_mode", False),
+        logging_cfg.get("flush_interval", 0.5),
+        logging_cfg.get("batch_size", 256)
     )
-    
+
     logging.info("[main] 日志系统初始化完成，日志文件路径: %s", log_path)
-    
-    # 从配置中读取数据路径参数    
+
+def init_profiling(config, force: bool = False):
+    # 从配置中读取性能记录参数，命令行 --profile 可强制启用
+    enabled = force or get_config_value(config, 'Profiling', 'enable', fallback = False)
+    if not enabled:
+        return
+
+    profiler.configure(
+        True,
+        get_config_value(config, 'Profiling', 'report_dir', fallback = "./ToolCodes/profiles/"),
+        get_config_value(config, 'Profiling', 'cprofile', fallback = False),
+        get_config_value(config, 'Profiling', 'trace_memory', fallback = False),
+        get_config_value(config, 'Profiling', 'rss_interval', fallback = 0.05)
+    )
+    logging.info(f"[main] 阶段级性能记录已启用，报告目录: {profiler.report_dir}")
+
+def stage_path(config, stage: str, override: str = None) -> str:
+    """阶段交接文件路径：命令行显式指定优先，否则为 stage_dir 下的默认文件"""
+    if override:
+        return override
+    stage_dir = get_config_value(config, 'DATAPATH', 'stage_dir', fallback="./ToolCodes/stages/")
+    return os.path.join(stage_dir, STAGE_FILES[stage])
+
+def save_stage(df, path: str):
+    import pandas as pd
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    pd.to_pickle(df, path)
+    logging.info(f"[main] 阶段结果已写入: {path}，样本数量: {len(df)}")
+
+def load_stage(path: str):
+    import pandas as pd
+
+    df = pd.read_pickle(path)
+    logging.info(f"[main] 读取阶段结果: {path}，样本数量: {len(df)}")
+    return df
+
+@profile_hook("preprocess")
+def run_preprocess(config):
+    from DataPreprocess import data_preprocessing
+    from schema_utils import compact_if_enabled
+
+    # 从配置中读取数据路径参数
     datapath_cfg = get_section_dict(config, 'DATAPATH')
     sourceData_folder = datapath_cfg["source_folder"]
     sourceData_list = datapath_cfg["source_list"]
-    
+
     logging.info(f"[main] 准备读取源数据，文件夹: {sourceData_folder}，文件列表: {sourceData_list}")
 
     # 2、数据预处理
     # 2.1、读取数据文件，返回 DataFrame
     filter_df = data_preprocessing(config, sourceData_list, sourceData_folder)
     logging.info(f"[main] 数据预处理完成，样本数量: {len(filter_df)}")
-    
+    return compact_if_enabled(filter_df, config)
+
+@profile_hook("annotate")
+def run_annotate(config, filter_df):
+    from schema_utils import compact_if_enabled
+
     # 3、API Pormopt 处理
     # 是否启用异步处理，同步sync: 1  异步async: 2, 默认值为: 1
     ASYNC_OR_SYNC = get_config_value(config, 'Processing_Mode', 'async_or_sync', fallback = 1)
 
+    # 3.1、本地预标注（可选）：置信行直接使用本地标签，只有其余行请求 API
+    local_masks = None
+    if get_config_value(config, 'Local_Prelabel', 'enable', fallback = False):
+        if ASYNC_OR_SYNC == 2:
+            from LocalPrelabel import local_prelabeling  # 依赖 scikit-learn，仅在启用时导入
+            filter_df, local_masks = local_prelabeling(filter_df, config)
+        else:
+            logging.warning("[main] 本地预标注仅支持异步处理模式，已跳过")
+
     if ASYNC_OR_SYNC == 1:   # 同步处理
+        from ApiPromptSync import api_prompt_sync
+
         logging.info("[main] 启动同步处理模式")
-        label_translate_quantityRelation_df = api_prompt_sync(filter_df, config)
+        return compact_if_enabled(api_prompt_sync(filter_df, config), config)
     elif ASYNC_OR_SYNC == 2:  # 异步处理
+        from ApiPromptAsync import api_prompt_async
+
         logging.info("[main] 启动异步处理模式")
-        label_translate_quantityRelation_df = api_prompt_async(filter_df, config)
+        return compact_if_enabled(api_prompt_async(filter_df, config, local_masks), config)
     else:
         logging.error(f"[main] 无效的模式参数: {ASYNC_OR_SYNC}，请选择 'sync' 或 'async'")
         # raise ValueError(f"[main] 无效的模式参数: {ASYNC_OR_SYNC}，请选择 'sync' 或 'async'") # 不在控制台（stderr）输出错误信息
+        return None
+
+@profile_hook("postprocess")
+def run_postprocess(config, label_translate_quantityRelation_df, data_output: str = None):
+    from DataPostprocess import data_postprocessing
 
     # 4、分词 编号 标准化输出
-    data_output = datapath_cfg["data_output"]
+    datapath_cfg = get_section_dict(config, 'DATAPATH')
+    data_output = data_output or datapath_cfg["data_output"]
     logging.info(f"[main] 开始输出结果到: {data_output}")
-    data_postprocessing(label_translate_quantityRelation_df, sourceData_list, data_output)
+    data_postprocessing(label_translate_quantityRelation_df, datapath_cfg["source_list"], data_output, config)
+
+def run_plan(config, filter_df):
+    from RunPlanner import plan_run
+
+    # dry-run：只构建 prompt 并估算，不发送任何请求
+    report = plan_run(filter_df, config)
+    print(json.dumps(report, ensure_ascii=False, indent=4))
+
+def cmd_run(args, config):
+    filter_df = run_preprocess(config)
+    if args.plan:
+        run_plan(config, filter_df)
+        return
+    annotated_df = run_annotate(config, filter_df)
+    if annotated_df is None:
+        return
+    run_postprocess(config, annotated_df, args.output)
     logging.info("[main] 所有流程执行完毕！")
-    
+
+def cmd_preprocess(args, config):
+    save_stage(run_preprocess(config), stage_path(config, "preprocess", args.output))
+
+def cmd_annotate(args, config):
+    filter_df = load_stage(stage_path(config, "preprocess", args.input))
+    if args.plan:
+        run_plan(config, filter_df)
+        return
+    annotated_df = run_annotate(config, filter_df)
+    if annotated_df is not None:
+        save_stage(annotated_df, stage_path(config, "annotate", args.output))
+
+def cmd_postprocess(args, config):
+    run_postprocess(config, load_stage(stage_path(config, "annotate", args.input)), args.output)
+    logging.info("[main] 后处理执行完毕！")
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="AutoMATH-Dataset 数据处理流水线")
+    parser.add_argument("--config", default=DEFAULT_CONFIG, help=f"配置文件路径（默认: {DEFAULT_CONFIG}）")
+    parser.add_argument("--profile", action="store_true", help="启用阶段级性能记录并写出运行报告（等同 [Profiling] enable = True）")
+
+    subparsers = parser.add_subparsers(dest="command")
+
+    p = subparsers.add_parser("run", help="完整流程：预处理 → API 标注 → 后处理（默认）")
+    p.add_argument("--output", help="最终 JSON 输出路径（默认: [DATAPATH] data_output）")
+    p.add_argument("--plan", action="store_true", help="dry-run：预处理后只估算请求数、token、费用和耗时，不发送请求")
+    p.set_defaults(func=cmd_run)
+
+    p = subparsers.add_parser("preprocess", help="仅预处理，结果写入阶段交接文件")
+    p.add_argument("--output", help="交接文件路径（默认: stage_dir/preprocessed.pkl）")
+    p.set_defaults(func=cmd_preprocess)
+
+    p = subparsers.add_parser("annotate", help="读取预处理结果进行 API 标注，结果写入阶段交接文件")
+    p.add_argument("--input", help="预处理交接文件（默认: stage_dir/preprocessed.pkl）")
+    p.add_argument("--output", help="交接文件路径（默认: stage_dir/annotated.pkl）")
+    p.add_argument("--plan", action="store_true", help="dry-run：只估算请求数、token、费用和耗时，不发送请求")
+    p.set_defaults(func=cmd_annotate)
+
+    p = subparsers.add_parser("postprocess", help="读取标注结果进行分词、编号与导出")
+    p.add_argument("--input", help="标注交接文件（默认: stage_dir/annotated.pkl）")
+    p.add_argument("--output", help="最终 JSON 输出路径（默认: [DATAPATH] data_output）")
+    p.set_defaults(func=cmd_postprocess)
+
+    return parser
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    # 不带子命令时保持原有行为：执行完整流程
+    if args.command is None:
+        args = parser.parse_args(["--config", args.config] + (["--profile"] if args.profile else []) + ["run"])
+
+    # 1、读取配置文件
+    if not os.path.isfile(args.config):
+        parser.error(f"配置文件不存在: {args.config}")
+    config = load_config(args.config)
+
+    init_logging(config)
+    init_profiling(config, args.profile)
+    status = "failed"
+    try:
+        args.func(args, config)
+        status = "success"
+    finally:
+        profiler.write_report(command=args.command, config=args.config, status=status)
+        # 队列模式下确保剩余日志全部写出
+        shutdown_logging()
+
 if __name__ == "__main__":
     """
     确保代码只在“直接运行该脚本”时才会被执行，而在被其他模块 import 时不会执行。
     __name__ 是 Python 的一个内置变量。当脚本被直接运行时，__name__ 的值是 "__main__";被其他文件通过 import 引入时，__name__ 的值就是该模块的名字
     """
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,215 @@
+import os
+import json
+import time
+import cProfile
+import logging
+import functools
+import threading
+import tracemalloc
+from datetime import datetime
+from contextlib import contextmanager
+
+try:
+    import resource  # 仅 POSIX 平台可用，用于读取进程峰值 RSS
+except ImportError:
+    resource = None
+
+def _rows(value):
+    """DataFrame（含 columns 属性）或 list 返回行数，其他返回 None"""
+    if hasattr(value, "columns") or isinstance(value, list):
+        return len(value)
+    return None
+
+def _max_rss_mb():
+    if resource is None:
+        return None
+    # Linux 下 ru_maxrss 单位为 KB
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+def _current_rss_mb():
+    """当前常驻内存（Linux /proc/self/statm），其他平台返回 None"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError, AttributeError):
+        return None
+
+class _RssSampler(threading.Thread):
+    """
+    后台线程：按固定间隔采样当前 RSS，更新所有进行中阶段的峰值（开销远低于 tracemalloc）
+    与 StageProfiler 共用一把锁：阶段出栈并取走峰值后，采样线程不会再写入该阶段的记录
+    """
+    def __init__(self, stack: list, lock: threading.Lock, interval: float):
+        super().__init__(name="rss-sampler", daemon=True)
+        self.stack = stack
+        self.lock = lock
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        rss = _current_rss_mb()
+        if rss is None:
+            return
+        with self.lock:
+            for record in self.stack:
+                record["_rss_peak"] = max(record.get("_rss_peak") or 0, rss)
+
+    def stop(self):
+        self._stopped.set()
+
+class StageProfiler:
+    """
+    阶段级性能记录（默认关闭，关闭时 stage / profile_hook 几乎无开销）
+
+    每个阶段记录：墙钟时间、CPU 时间、峰值内存、进程峰值 RSS、输入/输出行数；
+    峰值内存默认由后台线程采样 RSS 得到（几乎不影响计时），trace_memory 启用时改用 tracemalloc（Python 对象精确峰值，但会明显拖慢运行）；
+    可选为最外层阶段导出 cProfile 的 .pstats 文件。运行结束时写出一份 JSON 报告，便于跨运行对比
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.report_dir = None
+        self.cprofile = False
+        self.trace_memory = False
+        self.rss_sampler = None
+        self._lock = threading.Lock()
+        self.run_id = None
+        self.started_at = None
+        self.stages = []
+        self._stack = []
+
+    def configure(self, enabled: bool, report_dir: str = "./ToolCodes/profiles/", cprofile: bool = False,
+                  trace_memory: bool = False, rss_interval: float = 0.05):
+        self.enabled = enabled
+        if not enabled:
+            return
+
+        self.report_dir = report_dir
+        self.cprofile = cprofile
+        self.trace_memory = trace_memory
+        self.run_id = datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.started_at = time.perf_counter()
+        self.stages = []
+        os.makedirs(report_dir, exist_ok=True)
+
+        if trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+        elif self.rss_sampler is None and _current_rss_mb() is not None:
+            self.rss_sampler = _RssSampler(self._stack, self._lock, rss_interval)
+            self.rss_sampler.start()
+
+    @contextmanager
+    def stage(self, name: str, rows_in=None):
+        """记录一个阶段；调用方可在 with 块内设置 record["rows_out"]"""
+        if not self.enabled:
+            yield {}
+            return
+
+        record = {"name": name, "depth": len(self._stack), "parent": self._stack[-1]["name"] if self._stack else None,
+                  "rows_in": rows_in, "rows_out": None}
+
+        if self.trace_memory:
+            # 嵌套阶段会重置峰值计数，先把目前的峰值计入父阶段
+            if self._stack:
+                parent = self._stack[-1]
+                parent["_peak"] = max(parent["_peak"], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+            record["_peak"] = 0
+
+        profile = None
+        if self.cprofile and not self._stack:  # cProfile 不能嵌套启用，只对最外层阶段采样
+            profile = cProfile.Profile()
+            profile.enable()
+
+        with self._lock:
+            if self.rss_sampler is not None:
+                record["_rss_peak"] = _current_rss_mb()
+            self._stack.append(record)
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield record
+        finally:
+            record["wall_seconds"] = round(time.perf_counter() - wall, 4)
+            record["cpu_seconds"] = round(time.process_time() - cpu, 4)
+            with self._lock:
+                self._stack.pop()
+                rss_peak = record.pop("_rss_peak", None)
+
+            if profile is not None:
+                profile.disable()
+                pstats_path = os.path.join(self.report_dir, f"{self.run_id}_{name}.pstats")
+                profile.dump_stats(pstats_path)
+                record["pstats"] = pstats_path
+
+            if self.trace_memory:
+                peak = max(record.pop("_peak"), tracemalloc.get_traced_memory()[1])
+                record["peak_traced_mb"] = round(peak / 1024 / 1024, 1)
+                if self._stack:
+                    self._stack[-1]["_peak"] = max(self._stack[-1]["_peak"], peak)
+            elif self.rss_sampler is not None:
+                # 结束时再采样一次，短于采样间隔的阶段也有峰值；父阶段的峰值由采样线程同步更新
+                peak = max(rss_peak or 0, _current_rss_mb() or 0)
+                record["peak_rss_mb"] = round(peak, 1)
+                with self._lock:
+                    if self._stack:
+                        self._stack[-1]["_rss_peak"] = max(self._stack[-1].get("_rss_peak") or 0, peak)
+            record["max_rss_mb"] = _max_rss_mb()
+
+            self.stages.append(record)
+            logging.info({"event": "stage_profile", **record})
+
+    def write_report(self, **extra) -> str:
+        """写出本次运行的 JSON 报告，返回报告路径；未启用时返回 None"""
+        if not self.enabled:
+            return None
+
+        report = {
+            "run_id": self.run_id,
+            "timestamp": datetime.now().isoformat(),
+            "total_wall_seconds": round(time.perf_counter() - self.started_at, 4),
+            "max_rss_mb": _max_rss_mb(),
+            "trace_memory": self.trace_memory,
+            **extra,
+            "stages": self.stages,
+        }
+        report_path = os.path.join(self.report_dir, f"run_{self.run_id}.json")
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=4)
+        logging.info(f"[profile_utils] 运行报告已写入: {report_path}")
+        return report_path
+
+# 全局实例：由 main.py 根据 [Profiling] 配置或 --profile 参数启用
+profiler = StageProfiler()
+
+def profile_hook(name: str, rows_in=None):
+    """
+    装饰器：将函数调用记录为一个阶段，输出行数取返回的 DataFrame / list
+    rows_in：输入行数的来源
+        - None（默认）：第一个 DataFrame 参数的行数，没有则为 null（list 参数可能是文件列表等，不计为行数）
+        - int：该下标位置参数的行数（方法的下标包含 self）
+        - callable：以调用参数 (*args, **kwargs) 调用，返回行数
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return func(*args, **kwargs)
+
+            if callable(rows_in):
+                n_in = rows_in(*args, **kwargs)
+            elif isinstance(rows_in, int):
+                n_in = _rows(args[rows_in]) if rows_in < len(args) else None
+            else:
+                n_in = next((len(a) for a in args if hasattr(a, "columns")), None)
+            with profiler.stage(name, n_in) as record:
+                result = func(*args, **kwargs)
+                record["rows_out"] = _rows(result)
+            return result
+        return wrapper
+    return decorator
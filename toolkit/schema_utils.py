@@ -0,0 +1,78 @@
+import sys
+import logging
+import configparser
+import pandas as pd
+from config_utils import get_config_value
+
+# 流水线 DataFrame 的显式 schema：
+# - 低基数字段（source 5 种、reasoning_type 3 种）→ category
+# - 文本字段 → Arrow 字符串（未安装 pyarrow 时退回 pandas 字符串类型）
+# - 标签字段（problem_category / knowledge_tag）→ 驻留字符串组成的 tuple，相同标签全表只保存一份
+# - quantity_relation 为自由格式 dict，保持 object
+#
+# 阶段间交接约定：各阶段入口用 df.copy(deep=False) 取浅拷贝，之后只整列赋值（df[col] = ...），
+# 从不原地修改已有列的数据，因此交接时无需深拷贝整表；Copy-on-Write（enable_copy_on_write）开启后，
+# 即便某处原地修改，也只会复制被修改的列，不影响上一阶段持有的 DataFrame
+CATEGORY_FIELDS = ["source", "reasoning_type"]
+STRING_FIELDS = ["zh_text", "segmented_text", "en_text", "equation", "ans"]
+LABEL_FIELDS = ["problem_category", "knowledge_tag"]
+
+def _string_dtype() -> pd.StringDtype:
+    try:
+        import pyarrow  # noqa: F401
+        return pd.StringDtype("pyarrow")
+    except ImportError:
+        return pd.StringDtype("python")
+
+def _intern_labels(value):
+    """list[str] → tuple[str]（字符串驻留）；其他值（NA、解析失败的原始字符串、dict 等）原样保留"""
+    if isinstance(value, (list, tuple)):
+        return tuple(sys.intern(v) if isinstance(v, str) else v for v in value)
+    return value
+
+def enable_copy_on_write():
+    """pandas 2.x 需显式开启 Copy-on-Write，3.x 起为默认行为"""
+    if int(pd.__version__.split(".")[0]) == 2:
+        pd.set_option("mode.copy_on_write", True)
+
+def compact_dataframe(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    按 schema 转换列类型，返回新的 DataFrame（原 df 不变）
+    若某文本列含非字符串值导致转换失败，该列保持 object
+    """
+    df = df.copy(deep=False)
+    string_dtype = _string_dtype()
+
+    for col in CATEGORY_FIELDS:
+        if col in df.columns:
+            df[col] = df[col].astype("category")
+
+    for col in STRING_FIELDS:
+        if col not in df.columns:
+            continue
+        try:
+            df[col] = df[col].astype(string_dtype)
+        except (TypeError, ValueError) as e:
+            logging.warning(f"[schema_utils.compact_dataframe] 字段 {col} 无法转换为字符串类型，保持 object: {e}")
+
+    for col in LABEL_FIELDS:
+        if col in df.columns:
+            df[col] = df[col].map(_intern_labels).astype(object)
+
+    return df
+
+def compact_if_enabled(df: pd.DataFrame, config: configparser.ConfigParser) -> pd.DataFrame:
+    """[Data_Schema] compact 启用时转换为紧凑 schema，并开启 Copy-on-Write 使阶段间的浅拷贝交接安全"""
+    if get_config_value(config, 'Data_Schema', 'compact', fallback=False):
+        enable_copy_on_write()
+        return compact_dataframe(df)
+    return df
+
+def to_records(df: pd.DataFrame) -> list:
+    """导出为 JSON 可序列化的记录：缺失值（NA / NaN）统一为 None，标签 tuple 由 json 写为数组"""
+    records = df.to_dict(orient='records')
+    for record in records:
+        for key, value in record.items():
+            if value is not None and not isinstance(value, (list, tuple, dict)) and pd.isna(value):
+                record[key] = None
+    return records
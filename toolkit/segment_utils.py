@@ -0,0 +1,180 @@
+import os
+import marshal
+import sqlite3
+import hashlib
+import logging
+import configparser
+from multiprocessing import Pool
+from config_utils import get_section_dict
+from profile_utils import profile_hook
+
+# 多进程分词时，每个工作进程各自持有一个分词器
+_worker_tokenizer = None
+
+def _dict_fingerprint(user_dict: str = None) -> str:
+    """自定义词典的指纹（路径 + 修改时间 + 大小），词典变化后模型缓存和分词结果缓存自动失效"""
+    if not user_dict or not os.path.isfile(user_dict):
+        return "default"
+    stat = os.stat(user_dict)
+    raw = f"{os.path.abspath(user_dict)}|{stat.st_mtime_ns}|{stat.st_size}"
+    return hashlib.md5(raw.encode('utf-8')).hexdigest()[:12]
+
+def load_tokenizer(model_cache: str = None, user_dict: str = None):
+    """
+    加载 jieba 分词器：优先读取序列化的模型缓存（前缀词典 + 自定义词典合并后的结果），
+    缓存不存在或失效时从词典构建并写回缓存，后续运行只需一次 marshal.load
+    """
+    import jieba  # 延迟导入：只有分词阶段才需要 jieba
+
+    tokenizer = jieba.Tokenizer()
+    if not model_cache:
+        tokenizer.initialize()
+        if user_dict:
+            tokenizer.load_userdict(user_dict)
+        return tokenizer
+
+    cache_path = f"{model_cache}.{_dict_fingerprint(user_dict)}"
+    if os.path.isfile(cache_path):
+        try:
+            with open(cache_path, 'rb') as f:
+                tokenizer.FREQ, tokenizer.total = marshal.load(f)
+            tokenizer.initialized = True
+            return tokenizer
+        except Exception as e:
+            logging.warning(f"[segment_utils.load_tokenizer] 模型缓存读取失败，重新构建: {cache_path} → {e}")
+
+    tokenizer.initialize()
+    if user_dict:
+        tokenizer.load_userdict(user_dict)
+
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            marshal.dump((tokenizer.FREQ, tokenizer.total), f)
+        os.replace(tmp_path, cache_path)
+        logging.info(f"[segment_utils.load_tokenizer] 已写入模型缓存: {cache_path}")
+    except Exception as e:
+        logging.warning(f"[segment_utils.load_tokenizer] 模型缓存写入失败: {cache_path} → {e}")
+
+    return tokenizer
+
+def _init_worker(model_cache: str, user_dict: str):
+    global _worker_tokenizer
+    _worker_tokenizer = load_tokenizer(model_cache, user_dict)
+
+def _segment_chunk(texts: list) -> list:
+    return [" ".join(_worker_tokenizer.cut(t, cut_all=False)) for t in texts]
+
+class SegmentEngine:
+    """
+    分词引擎：
+    - 分词器在首次使用时加载一次（序列化模型缓存 + 可选的数学术语自定义词典）
+    - 按批分词，批量较大时可选多进程执行
+    - 以文本哈希为键，将分词结果持久化到 SQLite，跨运行复用
+    """
+
+    # SQLite 单条语句的参数个数有上限，分块查询
+    _lookup_chunk = 500
+
+    def __init__(self, model_cache: str = None, user_dict: str = None, cache_db: str = None,
+                 processes: int = 1, batch_size: int = 2000):
+        self.model_cache = model_cache
+        self.user_dict = user_dict
+        self.cache_db = cache_db
+        self.processes = processes
+        self.batch_size = batch_size
+
+        self.fingerprint = _dict_fingerprint(user_dict)
+        self._tokenizer = None
+        self._conn = None
+
+    @classmethod
+    def from_config(cls, config: configparser.ConfigParser) -> "SegmentEngine":
+        if 'Segmentation' not in config:
+            return cls()
+        seg_cfg = get_section_dict(config, 'Segmentation')
+        return cls(
+            model_cache=seg_cfg.get('model_cache') or None,
+            user_dict=seg_cfg.get('user_dict') or None,
+            cache_db=seg_cfg.get('cache_db') or None,
+            processes=seg_cfg.get('processes', 1),
+            batch_size=seg_cfg.get('batch_size', 2000)
+        )
+
+    @property
+    def tokenizer(self):
+        if self._tokenizer is None:
+            self._tokenizer = load_tokenizer(self.model_cache, self.user_dict)
+        return self._tokenizer
+
+    @property
+    def conn(self):
+        if self._conn is None and self.cache_db:
+            os.makedirs(os.path.dirname(os.path.abspath(self.cache_db)), exist_ok=True)
+            self._conn = sqlite3.connect(self.cache_db)
+            self._conn.execute("CREATE TABLE IF NOT EXISTS segments (key TEXT PRIMARY KEY, segmented TEXT NOT NULL)")
+        return self._conn
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha1(f"{self.fingerprint}\0{text}".encode('utf-8')).hexdigest()
+
+    def _lookup(self, keys: list) -> dict:
+        if self.conn is None:
+            return {}
+        found = {}
+        for start in range(0, len(keys), self._lookup_chunk):
+            chunk = keys[start:start + self._lookup_chunk]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self.conn.execute(f"SELECT key, segmented FROM segments WHERE key IN ({placeholders})", chunk)
+            found.update(rows)
+        return found
+
+    def _store(self, items: list):
+        if self.conn is None or not items:
+            return
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO segments (key, segmented) VALUES (?, ?)", items)
+
+    def _segment(self, texts: list) -> list:
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+
+        if self.processes > 1 and len(batches) > 1:
+            # 主进程先加载一次，确保模型缓存已写出，工作进程直接读取缓存
+            _ = self.tokenizer
+            with Pool(self.processes, initializer=_init_worker, initargs=(self.model_cache, self.user_dict)) as pool:
+                results = pool.map(_segment_chunk, batches)
+        else:
+            results = [[" ".join(self.tokenizer.cut(t, cut_all=False)) for t in batch] for batch in batches]
+
+        return [seg for batch in results for seg in batch]
+
+    def count_cached(self, texts: list) -> int:
+        """统计 texts 中（去重后）已有分词缓存的文本数，不加载分词器；缓存库不存在时返回 0"""
+        if not self.cache_db or not os.path.isfile(self.cache_db):
+            return 0
+        return len(self._lookup([self._key(t) for t in dict.fromkeys(texts)]))
+
+    @profile_hook("SegmentEngine.segment_batch", rows_in=1)  # 下标 0 为 self，1 为 texts
+    def segment_batch(self, texts: list) -> list:
+        """批量分词：相同文本只分一次，已缓存的文本直接复用"""
+        unique = list(dict.fromkeys(texts))
+        keys = {t: self._key(t) for t in unique}
+
+        cached = self._lookup(list(keys.values()))
+        results = {t: cached[k] for t, k in keys.items() if k in cached}
+
+        misses = [t for t in unique if t not in results]
+        logging.info(f"[SegmentEngine.segment_batch] 分词 {len(texts)} 条，去重后 {len(unique)} 条，缓存命中 {len(results)} 条")
+
+        if misses:
+            segmented = self._segment(misses)
+            results.update(zip(misses, segmented))
+            self._store([(keys[t], s) for t, s in zip(misses, segmented)])
+
+        return [results[t] for t in texts]
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None